@@ -23,12 +23,14 @@ import urllib.request
 from collections import Counter
 
 import numpy as np
+from scipy import sparse
 
 import temporal_network as tn
-from semantic_edges import attach_embeddings
+from semantic_edges import attach_embeddings, tfidf_features
 
 CLAUDE_MODEL = "claude-sonnet-4-6"
 RESULTS = "results.json"
+CONFIG = tn.TimelineConfig(edge_method="semantic")
 
 
 def load_corpus():
@@ -41,13 +43,14 @@ def load_corpus():
 
 
 # --- final communities ------------------------------------------------------
-def final_communities(books):
-    G = tn.build_snapshot(books)
-    comms = tn.detect_communities(G)
-    by_title = {b["title"]: b for b in books}
+def final_communities(books, config=CONFIG):
+    G = tn.build_snapshot(books, config)
+    comms = tn.detect_communities(G, config)
+    index = {b["title"]: i for i, b in enumerate(books)}
     out = []
     for c in comms:
-        members = [by_title[t] for t in c if t in by_title]
+        idx = [index[t] for t in c if t in index]
+        members = [books[i] for i in idx]
         if len(members) < 4:
             continue
         years = sorted(int(m["date_published"]) for m in members)
@@ -55,6 +58,7 @@ def final_communities(books):
                          if not g.startswith("Category:"))
         out.append({
             "members": members,
+            "idx": idx,
             "titles": [m["title"] for m in members],
             "size": len(members),
             "year_min": years[0], "year_max": years[-1],
@@ -64,15 +68,24 @@ def final_communities(books):
     return sorted(out, key=lambda d: d["birth_year"])
 
 
-def top_terms(members, books):
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    V = TfidfVectorizer(stop_words="english", max_features=20000,
-                        min_df=3, max_df=0.4, sublinear_tf=True)
-    X = V.fit_transform([b["description"] for b in books])
-    terms = np.array(V.get_feature_names_out())
-    idx = [i for i, b in enumerate(books) if b in members]
-    centroid = np.asarray(X[idx].mean(axis=0)).ravel()
-    return list(terms[np.argsort(-centroid)[:10]])
+def top_terms(communities, books, k=10):
+    '''communities: lists of book indices. Returns each one's k most
+    distinctive terms. Every centroid comes from one product of a sparse
+    community x book averaging matrix with the document-term matrix.'''
+    X, terms = tfidf_features([b["description"] for b in books])
+    rows = [ci for ci, idx in enumerate(communities) for _ in idx]
+    cols = [i for idx in communities for i in idx]
+    vals = [1.0 / len(idx) for idx in communities for _ in idx]
+    C = sparse.csr_matrix((vals, (rows, cols)), shape=(len(communities), len(books)))
+    centroids = (C @ X).toarray()
+
+    k = min(k, centroids.shape[1])
+    top = np.argpartition(-centroids, k - 1, axis=1)[:, :k]
+    out = []
+    for c, t in zip(centroids, top):
+        t = t[np.lexsort((t, -c[t]))]           # best first, ties by term index
+        out.append(list(terms[t]))
+    return out
 
 
 # --- LLM genre naming -------------------------------------------------------
@@ -99,13 +112,11 @@ def name_genre(sample_titles, terms):
 
 
 # --- robustness + curve fit -------------------------------------------------
-def timeline_for_k(books, k):
-    orig = tn.EDGE_KNN
-    tn.EDGE_KNN = k
-    grouped = tn.books_by_year([_flat(b) for b in books])
-    tl = tn.mutation_timeline(grouped)
-    tn.EDGE_KNN = orig
-    return tl
+def timelines_for_k(books, ks, seeds=(42,), config=CONFIG):
+    '''{(k, seed): timeline} for the robustness grid. The timeline corpus is
+    embedded once and its k-NN lists built once, at the largest k.'''
+    grouped = tn.books_by_year([_flat(b) for b in books], config)
+    return tn.timeline_sweep(grouped, ks, seeds, config)
 
 
 def _flat(b):
@@ -133,13 +144,13 @@ def fit_curves(years, cumulative):
 
 
 def main():
-    tn.EDGE_METHOD = "semantic"
     books = load_corpus()
     print(f"Corpus: {len(books)} canon novels")
 
     comms = final_communities(books)
-    for c in comms:
-        c["top_terms"] = top_terms(c["members"], books)
+    terms = top_terms([c.pop("idx") for c in comms], books)
+    for c, t in zip(comms, terms):
+        c["top_terms"] = t
         sample = [m["title"] for m in sorted(c["members"],
                   key=lambda m: int(m["date_published"]))]
         c["genre_name"] = name_genre(sample, c["top_terms"])
@@ -148,7 +159,8 @@ def main():
               f"[{c['size']:2d}]  <-> held-out: {c['held_out_label']}")
 
     # timeline at the default k, plus robustness sweep
-    base_tl = timeline_for_k(books, 6)
+    timelines = timelines_for_k(books, (4, 6, 8, 10))
+    base_tl = timelines[(6, 42)]
     years = [r["year"] for r in base_tl]
     cum_genres, seen = [], 0
     for r in base_tl:
@@ -161,7 +173,7 @@ def main():
 
     sweep = {}
     for k in (4, 6, 8, 10):
-        tl = timeline_for_k(books, k)
+        tl = timelines[(k, 42)]
         e = sum(r["mutations"] for r in tl if r["year"] < 1890)
         l = sum(r["mutations"] for r in tl if r["year"] >= 1890)
         sweep[k] = {"pre1890": e, "post1890": l,
@@ -51,7 +51,8 @@
     Run:  python build_influence_graph.py
     In:   _data/bibliography_books.json, _data/known_influences.json,
           _data/wikidata_influences.json (optional)
-    Out:  _data/influence_graph.json
+    Out:  _data/influence_graph.json (summary), _data/influence_edges.npz
+          (the candidate edges as columns - load_influence_graph() reads both)
 '''
 
 import json
@@ -70,15 +71,20 @@ import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from constants import shelved_books
+from sequential_null import STOP_PRECISION, decision_bars, run_null
 
 BOOKS_FILE = os.path.join(shelved_books, "bibliography_books.json")
 INFLUENCES_FILE = os.path.join(shelved_books, "known_influences.json")
 WIKIDATA_INFLUENCES_FILE = os.path.join(shelved_books, "wikidata_influences.json")
 OUT_FILE = os.path.join(shelved_books, "influence_graph.json")
+EDGES_FILE = os.path.join(shelved_books, "influence_edges.npz")
 
 DIGEST_WORDS_PER_BOOK = 250     # per-book excerpt length in the author digest
 MAX_BOOKS_PER_AUTHOR = 6        # earliest N matched books, bounds prolific authors
 WELL_REPRESENTED_MIN_BOOKS = 4  # density-control subset threshold (of MAX_BOOKS_PER_AUTHOR=6)
+PERMUTATION_MEMORY_MB = 64      # caps the (trials x pairs) index/value block of one null batch
+SIGNIFICANT_Z = 1.96            # two-sided 0.05 - the bar permutation_z's are read against
+DENSITY_VERDICT_Z = 3           # well-represented conceptual z the density verdict needs
 GEMINI_EMBED_MODEL = "gemini-embedding-001"
 CLAUDE_MODEL = "claude-sonnet-4-6"
 
@@ -225,44 +231,146 @@ def conceptual_similarity(names, digests):
 
 
 def build_directed_edges(names, years, forms, styl_sim, conc_sim):
-    edges = []
-    for i, a in enumerate(names):
-        for j, b in enumerate(names):
-            if i == j or years[i] >= years[j]:
-                continue                              # chronology gate: A must predate B
-            edges.append({
-                "from": a, "to": b,
-                "stylistic": round(float(styl_sim[i, j]), 4),
-                "conceptual": round(float(conc_sim[i, j]), 4),
-                "same_form": forms.get(a) == forms.get(b),
-                "year_gap": int(years[j] - years[i]),
-            })
-    return edges
-
-
-def permutation_z(real_pairs, all_names, name_idx, years, sim, trials=5000, rng=None):
+    '''Every chronologically permitted edge A -> B (A must predate B), as
+    columns rather than one dict per pair: "from"/"to" index into `names`,
+    float32 "stylistic"/"conceptual", bool "same_form", int32 "year_gap".
+    Rows run from-major, to-minor, the order the per-pair loop used.'''
+    i, j = np.nonzero(years[:, None] < years[None, :])   # chronology gate
+    form_codes = {}
+    form = np.array([form_codes.setdefault(forms.get(a), len(form_codes))
+                     for a in names])
+    return {
+        "from": i.astype(np.int32), "to": j.astype(np.int32),
+        "stylistic": styl_sim[i, j].astype(np.float32),
+        "conceptual": conc_sim[i, j].astype(np.float32),
+        "same_form": form[i] == form[j],
+        "year_gap": (years[j] - years[i]).astype(np.int32),
+    }
+
+
+def save_influence_graph(summary, edges, path=OUT_FILE, edges_path=EDGES_FILE):
+    '''The thin JSON summary for humans, plus the edge columns as one .npz
+    it points to (written via a temp file, like the embedding caches).'''
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = edges_path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **edges)
+    os.replace(tmp, edges_path)
+    summary = dict(summary, edges_file=os.path.relpath(edges_path, os.path.dirname(path) or "."))
+    json.dump(summary, open(path, "w", encoding="utf-8"), indent=2, ensure_ascii=False)
+
+
+def load_influence_graph(path=OUT_FILE):
+    '''(summary, edge columns) - the columns straight from the .npz. A graph
+    written before the columnar format (edges as a JSON list of dicts) loads
+    into the same columns.'''
+    graph = json.load(open(path, encoding="utf-8"))
+    if "edges_file" in graph:
+        with np.load(os.path.join(os.path.dirname(path), graph["edges_file"])) as z:
+            return graph, {k: z[k] for k in z.files}
+    idx = {a["name"]: i for i, a in enumerate(graph["authors"])}
+    rows = graph.pop("edges")
+    return graph, {
+        "from": np.array([idx[e["from"]] for e in rows], dtype=np.int32),
+        "to": np.array([idx[e["to"]] for e in rows], dtype=np.int32),
+        "stylistic": np.array([e["stylistic"] for e in rows], dtype=np.float32),
+        "conceptual": np.array([e["conceptual"] for e in rows], dtype=np.float32),
+        "same_form": np.array([e["same_form"] for e in rows], dtype=bool),
+        "year_gap": np.array([e["year_gap"] for e in rows], dtype=np.int32),
+    }
+
+
+class ForwardPairs:
+    '''Uniform sampler over forward-chronology pairs (i, j), years[i] <
+    years[j], without listing them. Each block (rows, cols) of boolean masks
+    admits i from rows and j from cols (blocks must not overlap; default: one
+    block of every author). Pairs are numbered exactly as the listed pool
+    was - np.where's row-major order, i then j ascending - so a seeded rng
+    draws the same null it always has. Only the masks and a running count of
+    each row's admitted later cols are kept - O(n), not the n x n mask and
+    ~n^2/2 index pairs: a pair number u < count maps to its row by
+    searchsorted on the running count, and to its col by offset into that
+    row's admitted cols, listed once per distinct row drawn.'''
+
+    def __init__(self, years, blocks=None):
+        self.years = np.asarray(years, dtype=np.float64)
+        n = len(self.years)
+        everyone = np.ones(n, dtype=bool)
+        self.blocks = [(np.asarray(r, dtype=bool), np.asarray(c, dtype=bool))
+                       for r, c in blocks or [(everyone, everyone)]]
+        per_row = np.zeros(n, dtype=np.int64)
+        for rows, cols in self.blocks:
+            later = np.sort(self.years[cols])
+            r = np.flatnonzero(rows)
+            per_row[r] += len(later) - np.searchsorted(later, self.years[r], side="right")
+        self.ends = np.cumsum(per_row)
+        self.count = int(self.ends[-1]) if n else 0
+
+    def rows(self):
+        '''Rows with at least one admitted pair.'''
+        return np.flatnonzero(np.diff(self.ends, prepend=0))
+
+    def later(self, i):
+        '''Row i's admitted cols, ascending: the j of its pairs in order.'''
+        admit = np.zeros(len(self.years), dtype=bool)
+        for rows, cols in self.blocks:
+            if rows[i]:
+                admit |= cols
+        return np.flatnonzero(admit & (self.years > self.years[i]))
+
+    def pair(self, u):
+        '''(i, j) index arrays for pair numbers u (any shape, 0 <= u < count).'''
+        u = np.asarray(u, dtype=np.int64)
+        i = np.searchsorted(self.ends, u, side="right")
+        k = (u - self.ends[i] + np.diff(self.ends, prepend=0)[i]).ravel()
+        j = np.empty_like(k)
+        order = np.argsort(i, axis=None, kind="stable")
+        rows, starts = np.unique(i.ravel()[order], return_index=True)
+        for row, lo, hi in zip(rows, starts, np.append(starts[1:], len(order))):
+            sel = order[lo:hi]
+            j[sel] = self.later(row)[k[sel]]
+        return i, j.reshape(u.shape)
+
+    def sample(self, rng, size):
+        return self.pair(rng.integers(0, self.count, size=size))
+
+
+def permutation_z(real_pairs, all_names, name_idx, years, sim, trials=5000, rng=None,
+                  thresholds=decision_bars(-SIGNIFICANT_Z, SIGNIFICANT_Z),
+                  precision=STOP_PRECISION, memory_mb=PERMUTATION_MEMORY_MB):
     '''Do documented (from, to) pairs show elevated similarity vs random pairs
     respecting the same forward-chronology constraint? Never used to build
-    edges - held-out validation only (module docstring / doc SS4).'''
+    edges - held-out validation only (module docstring / doc SS4). With
+    thresholds (the z values the caller's reading turns on) or precision
+    set, stops early once that is settled (sequential_null.run_null);
+    "trials" reports the draws used.
+
+    The null is drawn a (trials x pairs) block at a time, at most memory_mb
+    per block, from ForwardPairs - so memory is O(trials x pairs) plus O(n)
+    for the sampler, never O(n^2) beyond sim itself.'''
     rng = rng or np.random.default_rng(0)
     real_vals = [sim[name_idx[a], name_idx[b]] for a, b in real_pairs]
     if not real_vals:
         return None
     real_mean = float(np.mean(real_vals))
 
-    n = len(all_names)
-    candidate_i, candidate_j = np.where(years[:, None] < years[None, :])
-    if len(candidate_i) == 0:
+    candidates = ForwardPairs(years)
+    if candidates.count == 0:
         return None
-    null_means = []
-    for _ in range(trials):
-        pick = rng.choice(len(candidate_i), size=len(real_vals), replace=True)
-        null_means.append(sim[candidate_i[pick], candidate_j[pick]].mean())
-    null_means = np.array(null_means)
+    step = max(1, int(memory_mb * 2 ** 20) // (40 * len(real_vals)))
+
+    def draw(k):
+        null_means = np.empty(k)
+        for t in range(0, k, step):
+            i, j = candidates.sample(rng, (min(step, k - t), len(real_vals)))
+            null_means[t:t + len(i)] = sim[i, j].mean(axis=1)
+        return null_means
+
+    null_means = run_null(draw, real_mean, trials, thresholds, precision)
     z = (real_mean - null_means.mean()) / (null_means.std() + 1e-12)
     return {"real_mean": round(real_mean, 4), "null_mean": round(float(null_means.mean()), 4),
             "null_std": round(float(null_means.std()), 4), "z": round(float(z), 3),
-            "n_pairs": len(real_vals)}
+            "n_pairs": len(real_vals), "trials": len(null_means)}
 
 
 def resolve_held_out_pairs(filepath, name_idx, years):
@@ -319,12 +427,12 @@ def main():
     print("Conceptual (embedding) similarity matrix built")
 
     edges = build_directed_edges(names, years, forms, styl_sim, conc_sim)
-    same_form_n = sum(1 for e in edges if e["same_form"])
-    print(f"{len(edges)} directed candidate edges "
-          f"({same_form_n} same-form, {len(edges)-same_form_n} cross-form)")
+    n_edges = len(edges["from"])
+    same_form_n = int(edges["same_form"].sum())
+    print(f"{n_edges} directed candidate edges "
+          f"({same_form_n} same-form, {n_edges-same_form_n} cross-form)")
 
-    signal_corr = float(np.corrcoef(
-        [e["stylistic"] for e in edges], [e["conceptual"] for e in edges])[0, 1])
+    signal_corr = float(np.corrcoef(edges["stylistic"], edges["conceptual"])[0, 1])
     print(f"Correlation between stylistic and conceptual signal across all edges: "
           f"{signal_corr:.3f}")
 
@@ -366,14 +474,16 @@ def main():
     rng = np.random.default_rng(0)
     wr_styl_val = permutation_z(wr_real_pairs, wr_names, wr_name_idx, wr_years, wr_styl_sim, rng=rng)
     rng = np.random.default_rng(0)
-    wr_conc_val = permutation_z(wr_real_pairs, wr_names, wr_name_idx, wr_years, wr_conc_sim, rng=rng)
+    wr_conc_val = permutation_z(wr_real_pairs, wr_names, wr_name_idx, wr_years, wr_conc_sim, rng=rng,
+                                thresholds=decision_bars(-SIGNIFICANT_Z, SIGNIFICANT_Z,
+                                                         DENSITY_VERDICT_Z))
     print(f"Well-represented subset (n_books_used>={WELL_REPRESENTED_MIN_BOOKS}, "
           f"n={len(wr_names)} authors, {len(wr_real_pairs)} pairs): "
           f"stylistic={wr_styl_val}, conceptual={wr_conc_val}")
 
     density_verdict = (
         "conceptual effect survives - not primarily a density artifact"
-        if wr_conc_val and wr_conc_val["z"] > 3
+        if wr_conc_val and wr_conc_val["z"] > DENSITY_VERDICT_Z
         else "conceptual effect weakens substantially in the well-represented "
              "subset - density may be a real confound, investigate further"
     )
@@ -381,14 +491,13 @@ def main():
 
     out = {
         "n_authors": len(names),
-        "n_edges": len(edges),
+        "n_edges": n_edges,
         "signal_correlation": round(signal_corr, 3),
-        "same_form_pct": round(100 * same_form_n / len(edges), 1) if edges else None,
+        "same_form_pct": round(100 * same_form_n / n_edges, 1) if n_edges else None,
         "authors": [{"name": a, "earliest_year": int(years[i]), "form": forms.get(a),
                     "n_books_used": authors[a]["n_books_used"],
                     "n_books_total": authors[a]["n_books_total"]}
                    for i, a in enumerate(names)],
-        "edges": edges,
         "held_out_validation": {
             "n_known_pairs_in_graph": len(real_pairs),
             "stylistic": styl_val,
@@ -412,9 +521,8 @@ def main():
             "verdict": density_verdict,
         },
     }
-    os.makedirs(shelved_books, exist_ok=True)
-    json.dump(out, open(OUT_FILE, "w", encoding="utf-8"), indent=2, ensure_ascii=False)
-    print(f"\nWrote {OUT_FILE}")
+    save_influence_graph(out, edges)
+    print(f"\nWrote {OUT_FILE} + {EDGES_FILE}")
 
 
 if __name__ == "__main__":
@@ -22,19 +22,36 @@
     Run:  python controls.py   ->   controls_results.json
 '''
 
+import functools
+import hashlib
 import json
 import os
 import collections
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import networkx as nx
 import networkx.algorithms.community as nxc
-from sklearn.feature_extraction.text import TfidfVectorizer
+from scipy import sparse
 
 from constants import shelved_books
+import semantic_edges
+from semantic_edges import knn_adjacency, knn_edges, knn_recall, tfidf_features
+from sequential_null import STOP_PRECISION, decision_bars, run_null
 
 K = 6
 SEED = 42
+NULL_MEMORY_MB = 64        # caps the (trials x n) work arrays of one null batch
+NULL_TRIALS = 3000
+EMERGENT_Z = -2.0          # one-sided: a community this concentrated is emergent
+NULL_CACHE_DIR = os.path.join(shelved_books, "null_cache")   # None = off
+# Shared size-keyed null tables (null_table) instead of one seeded stream
+# walked community by community. Off by default: the published z values come
+# from the stream, and a table's draws are a different Monte Carlo sample.
+NULL_TABLE = os.environ.get("NULL_TABLE") == "1"
+RESAMPLES = int(os.environ.get("RESAMPLES", "0"))  # random one-per-author draws; 0 = off
+TARGET_LABEL = "Detective and mystery stories"    # the genre the resampling tracks
 
 
 def load():
@@ -44,17 +61,17 @@ def load():
 
 
 def tfidf(texts):
-    V = TfidfVectorizer(stop_words="english", max_features=20000,
-                        min_df=3, max_df=0.4, sublinear_tf=True)
-    X = V.fit_transform(texts).toarray().astype(np.float32)
-    return X, np.array(V.get_feature_names_out())
+    '''CSR document-term matrix + terms, from the shared feature store.'''
+    return tfidf_features(texts)
 
 
 def detrend_years(X, years):
-    '''Control 2: remove the per-feature linear year component (style drift).'''
+    '''Control 2: remove the per-feature linear year component (style drift).
+    X may be CSR; the rank-one correction touches every entry, so the
+    detrended result is dense.'''
     yc = years - years.mean()
-    beta = (X * yc[:, None]).sum(0) / (yc @ yc)
-    return X - np.outer(yc, beta)
+    beta = np.asarray(X.T @ yc).ravel() / (yc @ yc)
+    return (X.toarray() if sparse.issparse(X) else X) - np.outer(yc, beta)
 
 
 def normalize(M):
@@ -63,20 +80,278 @@ def normalize(M):
 
 def knn_graph(M, k=K):
     M = normalize(M)
-    S = M @ M.T
-    np.fill_diagonal(S, -1.0)
     G = nx.Graph()
     G.add_nodes_from(range(M.shape[0]))
-    for i in range(M.shape[0]):
-        for j in np.argpartition(-S[i], k)[:k]:
-            G.add_edge(i, int(j))
+    G.add_edges_from(knn_edges(knn_adjacency(M, k)))
     return G, M
 
 
-def concentration_z(member_years, all_years, rng, trials=3000):
-    draws = [all_years[rng.choice(len(all_years), len(member_years),
-             replace=False)].std() for _ in range(trials)]
-    return (member_years.std() - np.mean(draws)) / np.std(draws)
+class DetrendedGram:
+    '''Cosine similarities between detrended, normalized rows - for ANY book
+    subset, with no dense detrended matrix. detrend_years on a subset S is
+    the projection P = I - u u^T (u = the subset's centred years, unit
+    length) applied to X_S, so its Gram matrix is
+        P G_S P = G_S - u (G_S u)^T - (G_S u) u^T + (u^T G_S u) u u^T,
+    with G = X X^T computed once for the whole corpus. Row norms are its
+    diagonal. Re-detrending a subset (one book per author, leave-one-out,
+    resamples) is then a slice of G plus rank-one corrections.'''
+
+    def __init__(self, X, years):
+        self.X = semantic_edges._as64(X)
+        self.years = np.asarray(years, dtype=float)
+        G = self.X @ self.X.T
+        self.G = G.toarray() if sparse.issparse(G) else np.asarray(G)
+
+    def _pieces(self, rows):
+        rows = np.asarray(rows)
+        yc = self.years[rows] - self.years[rows].mean()
+        u = yc / np.sqrt(yc @ yc)
+        Gs = self.G[np.ix_(rows, rows)]
+        Gu = Gs @ u
+        ugu = u @ Gu
+        diag = np.diag(Gs) - 2 * u * Gu + ugu * u * u
+        norms = np.clip(np.sqrt(np.clip(diag, 0, None)), 1e-9, None)
+        return rows, u, Gs, Gu, ugu, norms
+
+    def vectors(self, rows, members):
+        '''normalize(detrend_years(X[rows], years[rows]))[members], dense -
+        only the requested rows are ever materialised.'''
+        rows, u, _, _, _, norms = self._pieces(rows)
+        beta = np.asarray(self.X[rows].T @ u).ravel()
+        Xm = self.X[rows[members]]
+        Xm = Xm.toarray() if sparse.issparse(Xm) else Xm
+        return (Xm - np.outer(u[members], beta)) / norms[members, None]
+
+    def knn_adjacency(self, rows, k, memory_mb=semantic_edges.KNN_MEMORY_MB):
+        '''semantic_edges.knn_adjacency of the subset's detrended, normalized
+        rows, computed from the Gram pieces a block of rows at a time.'''
+        rows, u, Gs, Gu, ugu, norms = self._pieces(rows)
+        n = len(rows)
+        k = min(k, n - 1)
+        if k <= 0:
+            return sparse.csr_matrix((n, n), dtype=np.float32)
+        nbr = np.empty((n, k), dtype=np.int64)
+        sim = np.empty((n, k), dtype=np.float32)
+        step = max(1, int(memory_mb * 2 ** 20) // (12 * n))
+        for lo in range(0, n, step):
+            b = np.arange(lo, min(lo + step, n))
+            D = (Gs[b] - np.outer(u[b], Gu) - np.outer(Gu[b], u)
+                 + ugu * np.outer(u[b], u))
+            S = (D / np.outer(norms[b], norms)).astype(np.float32)
+            S[np.arange(len(b)), b] = -np.inf
+            nbr[b] = semantic_edges.knn_neighbors(S, k)
+            sim[b] = np.take_along_axis(S, nbr[b], axis=1)
+        return sparse.csr_matrix((sim.ravel(), nbr.ravel(), np.arange(0, n * k + 1, k)),
+                                 shape=(n, n))
+
+    def knn_graph(self, rows, k=K):
+        G = nx.Graph()
+        G.add_nodes_from(range(len(rows)))
+        G.add_edges_from(knn_edges(self.knn_adjacency(rows, k)))
+        return G
+
+
+def _uint32s(bitgen, count):
+    '''The next `count` values the generator's next_uint32 would return,
+    consumed exactly as it would: PCG64 splits each 64-bit draw into two
+    32-bit halves, low first, and buffers an unused high half across calls.'''
+    st = bitgen.state
+    head = [st["uinteger"]] if st["has_uint32"] and count else []
+    rest = count - len(head)
+    raw = bitgen.random_raw((rest + 1) // 2).astype(np.uint64)
+    halves = np.empty(2 * len(raw), dtype=np.uint64)
+    halves[0::2] = raw & np.uint64(0xFFFFFFFF)
+    halves[1::2] = raw >> np.uint64(32)
+    st = bitgen.state
+    if count:
+        st["has_uint32"] = rest % 2
+        st["uinteger"] = int(halves[-1]) if rest % 2 else 0
+    bitgen.state = st
+    return np.concatenate([np.array(head, dtype=np.uint64), halves[:rest]])
+
+
+def _floyd_batch(U, n, m):
+    '''Replay Generator.choice(n, m, replace=False) on a (trials, draws) block
+    of uint32s: Floyd's algorithm, then the shuffle of its output, each step
+    a Lemire bounded draw. Returns the index rows and, per trial, whether a
+    draw would have been rejected (the block is then off-stream from there).'''
+    floyd = np.arange(max(n - m, 1), n)          # a bound of 0 consumes no draw
+    bounds = np.concatenate([floyd, np.arange(m - 1, 0, -1)]).astype(np.uint64) + 1
+    prod = U * bounds
+    vals = (prod >> np.uint64(32)).astype(np.int64)
+    rejected = ((prod & np.uint64(0xFFFFFFFF)) < (2 ** 32 - bounds) % bounds).any(axis=1)
+
+    trials = U.shape[0]
+    rows = np.arange(trials)
+    taken = np.zeros((trials, n), dtype=bool)
+    idx = np.empty((trials, m), dtype=np.int64)
+    col = 0
+    for s, j in enumerate(range(n - m, n)):
+        v = vals[:, col] if j else np.zeros(trials, dtype=np.int64)
+        col += bool(j)
+        pick = np.where(taken[rows, v], j, v)
+        taken[rows, pick] = True
+        idx[:, s] = pick
+    for i in range(m - 1, 0, -1):
+        j = vals[:, col]
+        col += 1
+        idx[rows, i], idx[rows, j] = idx[rows, j], idx[rows, i]
+    return idx, rejected
+
+
+def _choice_loop(rng, n, m, trials):
+    return np.array([rng.choice(n, m, replace=False) for _ in range(trials)],
+                    dtype=np.int64).reshape(trials, m)
+
+
+def _live_state(rng):
+    state = dict(rng.bit_generator.state)
+    if not state["has_uint32"]:
+        state["uinteger"] = 0             # stale, never read again
+    return state
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_matches_numpy():
+    '''Self-check: does the batched replay still reproduce this numpy's
+    Generator.choice, rows and final state, on small cases - including a
+    buffered half-draw and m == n? _floyd_batch mirrors numpy internals, so
+    an upgrade that changes them must not silently change the nulls.'''
+    for seed, n, m, trials, skew in ((0, 20, 5, 50, 0), (1, 7, 7, 20, 1),
+                                     (2, 166, 13, 30, 1), (3, 9, 1, 10, 0)):
+        a, b = np.random.default_rng(seed), np.random.default_rng(seed)
+        if skew:                      # leave a buffered 32-bit half behind
+            a.integers(0, 2 ** 31, dtype=np.uint32)
+            b.integers(0, 2 ** 31, dtype=np.uint32)
+        if not (np.array_equal(_choice_loop(a, n, m, trials),
+                               _floyd_rows(b, n, m, trials, NULL_MEMORY_MB))
+                and _live_state(a) == _live_state(b)):
+            warnings.warn("batched choice no longer matches numpy's "
+                          "Generator.choice; drawing nulls one trial at a time")
+            return False
+    return True
+
+
+def choice_batch(rng, n, m, trials, memory_mb=NULL_MEMORY_MB):
+    '''[rng.choice(n, m, replace=False) for _ in range(trials)] as one
+    (trials, m) array, drawn for all trials at once - same rows, and the same
+    generator state afterwards. Work arrays stay under memory_mb. The replay
+    is PCG64-specific and self-checked against numpy (_batch_matches_numpy);
+    any other generator, or a failed check, takes the plain loop.'''
+    if (m == 0 or (n > 10000 and m > n // 50)    # numpy's tail-shuffle path
+            or not isinstance(rng.bit_generator, np.random.PCG64)
+            or not _batch_matches_numpy()):
+        return _choice_loop(rng, n, m, trials)
+    return _floyd_rows(rng, n, m, trials, memory_mb)
+
+
+def _floyd_rows(rng, n, m, trials, memory_mb):
+    '''choice_batch's replay proper (PCG64 only).'''
+    per = 2 * m - 1 - (m == n)                   # uint32 draws per trial
+    step = max(1, int(memory_mb * 2 ** 20) // (8 * (n + 4 * per)))
+    out = np.empty((trials, m), dtype=np.int64)
+    t = 0
+    while t < trials:
+        T = min(step, trials - t)
+        start = rng.bit_generator.state
+        idx, rejected = _floyd_batch(_uint32s(rng.bit_generator, T * per)
+                                     .reshape(T, per), n, m)
+        if rejected.any():
+            # A rejection (p ~ n / 2^32 per draw) shifts the stream: keep the
+            # trials before it, rewind to it, and let numpy draw that one.
+            f = int(np.argmax(rejected))
+            rng.bit_generator.state = start
+            _uint32s(rng.bit_generator, f * per)
+            out[t:t + f] = idx[:f]
+            out[t + f] = rng.choice(n, m, replace=False)
+            t += f + 1
+        else:
+            out[t:t + T] = idx
+            t += T
+    return out
+
+
+_null_tables = {}
+
+
+def _null_key(all_years, n, trials, seed):
+    digest = hashlib.sha256(all_years.tobytes()).hexdigest()[:16]
+    key = (digest, n, trials, seed)
+    path = None
+    if NULL_CACHE_DIR:
+        path = os.path.join(NULL_CACHE_DIR, "null-{}-n{}-t{}-s{}.npy".format(*key))
+    return key, path
+
+
+def _null_draws(all_years, n, rng):
+    '''draw(k) for run_null: year spreads of the next k size-n draws.'''
+    return lambda k: all_years[choice_batch(rng, len(all_years), n, k)].std(axis=1)
+
+
+def null_table(all_years, n, trials=NULL_TRIALS, seed=SEED):
+    '''Year spreads of `trials` random size-n draws from all_years: the whole
+    concentration null for every community of n books. It depends on nothing
+    else, so it is drawn once per (years, n, trials, seed) - from its own
+    generator, default_rng([seed, n]), so the table is the same whatever order
+    sizes are asked for in - and kept in memory and in NULL_CACHE_DIR.'''
+    all_years = np.ascontiguousarray(all_years, dtype=float)
+    key, path = _null_key(all_years, n, trials, seed)
+    if key in _null_tables:
+        return _null_tables[key]
+    if path and os.path.isfile(path):
+        _null_tables[key] = np.load(path)
+        return _null_tables[key]
+    draws = _null_draws(all_years, n, np.random.default_rng([seed, n]))(trials)
+    if path:
+        os.makedirs(NULL_CACHE_DIR, exist_ok=True)
+        semantic_edges._save_npy(path, draws)
+    _null_tables[key] = draws
+    return draws
+
+
+def precompute_nulls(all_years, sizes=None, trials=NULL_TRIALS, seed=SEED):
+    '''Fill the null table for every size in `sizes` (default 5..N) up front.'''
+    for n in sizes or range(5, len(all_years) + 1):
+        null_table(all_years, n, trials, seed)
+
+
+def concentration_test(member_years, all_years, rng=None, trials=NULL_TRIALS,
+                       seed=SEED, thresholds=decision_bars(EMERGENT_Z),
+                       precision=STOP_PRECISION):
+    '''concentration_z plus the number of null draws behind it. With
+    thresholds (the z values the caller decides on; EMERGENT_Z by default)
+    or precision set, the null stops early once settled (run_null); a
+    stopped run is always a prefix of the full one, and an uncached table is
+    then never drawn past the stopping point.'''
+    all_years = np.ascontiguousarray(all_years, dtype=float)
+    n = len(member_years)
+    observed = member_years.std()
+    key, path = _null_key(all_years, n, trials, seed)
+    cached = key in _null_tables or bool(path and os.path.isfile(path))
+    if rng is None and (cached or not thresholds and precision is None):
+        table, used = null_table(all_years, n, trials, seed), 0
+
+        def draw(k):
+            nonlocal used
+            used += k
+            return table[used - k:used]
+    else:
+        draw = _null_draws(all_years, n, rng or np.random.default_rng([seed, n]))
+    draws = run_null(draw, observed, trials, thresholds, precision)
+    z = (observed - np.mean(draws)) / np.std(draws)
+    return {"z": float(z), "trials": len(draws)}
+
+
+def concentration_z(member_years, all_years, rng=None, trials=NULL_TRIALS,
+                    seed=SEED, thresholds=decision_bars(EMERGENT_Z),
+                    precision=STOP_PRECISION):
+    '''z of the members' year spread against `trials` random same-size draws.
+    An rng draws a fresh null - exactly the rng.choice(..., replace=False)
+    sequence the original per-trial loop made, generated in one batch - and
+    is what the published results use. With no rng the draws come from the
+    shared null_table for this size (NULL_TABLE=1 in the scripts).'''
+    return concentration_test(member_years, all_years, rng, trials, seed,
+                              thresholds, precision)["z"]
 
 
 def clean_label(book):
@@ -85,15 +360,96 @@ def clean_label(book):
     return labs
 
 
+def target_community(comms, is_target):
+    '''The community holding the most TARGET_LABEL books (None if none do).'''
+    best = max(comms, key=lambda c: sum(is_target[i] for i in c), default=None)
+    return best if best and any(is_target[i] for i in best) else None
+
+
+_resample_state = None
+
+
+def _init_resample(state):
+    global _resample_state
+    _resample_state = state
+
+
+def _resample_draw(d):
+    '''Control 3 with a random book per author instead of the earliest: a
+    slice of the shared DetrendedGram, Louvain, and the target community's
+    concentration_z. Draw d's generator is default_rng([SEED, d]), so a
+    draw's result never depends on which worker ran it.'''
+    gram, by_author, is_target, book_author = _resample_state
+    rng = np.random.default_rng([SEED, d])
+    keep = np.sort([b[rng.integers(len(b))] for b in by_author])
+    yk = gram.years[keep]
+    comms = [c for c in nxc.louvain_communities(gram.knn_graph(keep), seed=SEED)
+             if len(c) >= 5]
+    c = target_community(comms, is_target[keep])
+    if c is None:
+        return {"draw": d, "z": None, "n": 0, "authors": []}
+    idx = sorted(c)
+    return {"draw": d, "z": float(concentration_z(yk[idx], yk, rng)), "n": len(idx),
+            "authors": sorted(int(book_author[keep[i]]) for i in idx)}
+
+
+def resample_authors(gram, authors, is_target, reference, draws=RESAMPLES,
+                     workers=None):
+    '''Control 3's verdict across `draws` random one-book-per-author subsets,
+    run across a process pool. Every draw slices the same full-corpus Gram
+    matrix - no TF-IDF refit, no dense detrend. Reports the distribution of
+    the target community's z, and how stable its membership is: Jaccard of
+    its AUTHORS against `reference` (the earliest-book run's), and how often
+    each author lands in it. A draw that finds no target community counts as
+    not emergent and Jaccard 0, so a community that often dissolves cannot
+    look stable; z quantiles are over the draws that found one, reported
+    next to not_found_rate.'''
+    names = sorted(set(authors))
+    code = {a: i for i, a in enumerate(names)}
+    book_author = np.array([code[a] for a in authors])
+    by_author = [np.flatnonzero(book_author == i) for i in range(len(names))]
+    ref = {code[a] for a in reference}
+    state = (gram, by_author, np.asarray(is_target), book_author)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_resample,
+                             initargs=(state,)) as pool:
+        runs = list(pool.map(_resample_draw, range(draws)))
+
+    zs = np.array([r["z"] for r in runs if r["z"] is not None])
+    jac = [len(ref & set(r["authors"])) / len(ref | set(r["authors"]))
+           if r["authors"] else 0.0 for r in runs] if ref else []
+    seen = collections.Counter(a for r in runs for a in r["authors"])
+    return {
+        "draws": draws, "target": TARGET_LABEL,
+        "found": len(zs),
+        "not_found_rate": round(1 - len(zs) / draws, 3) if draws else None,
+        "z_median": round(float(np.median(zs)), 2) if len(zs) else None,
+        "z_p05": round(float(np.percentile(zs, 5)), 2) if len(zs) else None,
+        "z_p95": round(float(np.percentile(zs, 95)), 2) if len(zs) else None,
+        "share_emergent": round(float(np.sum(zs <= EMERGENT_Z)) / draws, 3) if draws else None,
+        "jaccard_median": round(float(np.median(jac)), 3) if jac else None,
+        "author_frequency": {names[a]: round(n / draws, 3)
+                             for a, n in seen.most_common(25)},
+        "z": [None if r["z"] is None else round(r["z"], 2) for r in runs],
+    }
+
+
 def main():
     books = load()
     authors = [b["author"] for b in books]
     years_all = np.array([int(b["date_published"]) for b in books], float)
     X, terms = tfidf([b["description"] for b in books])
 
+    # Exact k-NN graphs of the detrended corpus, and of any subset of it, are
+    # slices of one Gram matrix (DetrendedGram); the LSH backend needs the
+    # detrended vectors themselves.
+    lsh = semantic_edges.KNN_BACKEND == "lsh"
+    gram = None if lsh else DetrendedGram(X, years_all)
+
     # --- quantify the author confound on the raw (style-controlled) graph ---
-    Xd = detrend_years(X, years_all)
-    G_raw, _ = knn_graph(Xd)
+    if lsh:
+        G_raw, _ = knn_graph(detrend_years(X, years_all))
+    else:
+        G_raw = gram.knn_graph(np.arange(len(books)))
     same = sum(authors[u] == authors[v] for u, v in G_raw.edges())
     author_confound = round(100 * same / G_raw.number_of_edges(), 1)
 
@@ -103,9 +459,15 @@ def main():
         if authors[i] not in seen:
             seen.add(authors[i]); keep.append(i)
     keep = np.array(sorted(keep))
-    Xk, yk = X[keep], years_all[keep]
-    Xkd = detrend_years(Xk, yk)                 # re-detrend on the subset
-    G, M = knn_graph(Xkd)
+    yk = years_all[keep]
+    recall = 1.0
+    if lsh:
+        G, M = knn_graph(detrend_years(X[keep], yk))   # re-detrend on the subset
+        recall = round(knn_recall(M, knn_adjacency(M, K)), 3)
+        vectors = lambda idx: M[idx]
+    else:
+        G = gram.knn_graph(keep)                        # re-detrended on the subset
+        vectors = lambda idx: gram.vectors(keep, idx)
     comms = [c for c in nxc.louvain_communities(G, seed=SEED) if len(c) >= 5]
 
     rng = np.random.default_rng(0)
@@ -113,26 +475,39 @@ def main():
     for c in comms:
         idx = list(c)
         ys = yk[idx]
-        centroid = M[idx].mean(0)
+        centroid = vectors(idx).mean(0)
         top = list(terms[np.argsort(-centroid)[:6]])
         labs = collections.Counter(g for i in idx for g in clean_label(books[keep[i]]))
+        test = concentration_test(ys, yk, None if NULL_TABLE else rng)
         results.append({
             "n": len(idx),
             "year_min": int(ys.min()), "year_max": int(ys.max()),
             "year_std": round(float(ys.std()), 1),
-            "concentration_z": round(float(concentration_z(ys, yk, rng)), 2),
+            "concentration_z": round(test["z"], 2),
+            "null_trials": test["trials"],
             "top_terms": top,
             "held_out_label": labs.most_common(1)[0][0] if labs else None,
         })
     results.sort(key=lambda r: r["concentration_z"])
 
-    emergent = [r for r in results if r["concentration_z"] <= -2.0]
+    resampling = None
+    if RESAMPLES:
+        if lsh:
+            raise ValueError("RESAMPLES slices the exact Gram matrix; "
+                             "unset KNN_BACKEND=lsh")
+        is_target = np.array([TARGET_LABEL in clean_label(b) for b in books])
+        ref = target_community(comms, is_target[keep]) or ()
+        resampling = resample_authors(gram, authors, is_target,
+                                      {authors[keep[i]] for i in ref})
+
+    emergent = [r for r in results if r["concentration_z"] <= EMERGENT_Z]
     print(f"Corpus: {len(books)} books / {len(set(authors))} authors")
     print(f"Author confound: {author_confound}% of k-NN edges same-author")
-    print(f"One-per-author subset: {len(keep)} books\n")
+    print(f"One-per-author subset: {len(keep)} books")
+    print(f"k-NN backend: {semantic_edges.KNN_BACKEND} (recall@{K} {recall})\n")
     print(f"{'z':>6} {'n':>3} {'years':>10} {'held-out label':28s} top terms")
     for r in results:
-        tag = "  <-- EMERGENT" if r["concentration_z"] <= -2.0 else ""
+        tag = "  <-- EMERGENT" if r["concentration_z"] <= EMERGENT_Z else ""
         print(f"{r['concentration_z']:+6.1f} {r['n']:>3} "
               f"{r['year_min']}-{r['year_max']} {str(r['held_out_label'])[:28]:28s} "
               f"{' '.join(r['top_terms'][:4])}{tag}")
@@ -141,8 +516,10 @@ def main():
         "author_confound_pct": author_confound,
         "n_books": len(books), "n_authors": len(set(authors)),
         "n_one_per_author": len(keep),
+        "knn_backend": semantic_edges.KNN_BACKEND, "knn_recall": recall,
         "communities": results,
         "emergent_genres": emergent,
+        "resampling": resampling,
         "verdict": ("No global mutation rate. After controlling density, style "
                     "drift, and author voice, detective fiction is the one robust, "
                     "label-validated temporal emergence; the rest are perennial modes."),
@@ -150,6 +527,13 @@ def main():
     json.dump(out, open("controls_results.json", "w"), indent=2)
     print(f"\nEmergent (z<=-2): "
           f"{[r['held_out_label'] for r in emergent]}")
+    if resampling:
+        print(f"Resampled one-per-author x{RESAMPLES}: {TARGET_LABEL} found in "
+              f"{resampling['found']} (not found {resampling['not_found_rate']:.0%}), "
+              f"z median {resampling['z_median']} "
+              f"[{resampling['z_p05']}, {resampling['z_p95']}], emergent in "
+              f"{resampling['share_emergent']:.0%}, author Jaccard vs earliest-book "
+              f"run {resampling['jaccard_median']}")
     print("Wrote controls_results.json")
 
 
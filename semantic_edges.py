@@ -9,63 +9,395 @@
     semantically close. Genres then emerge from the prose itself.
 
     Backends, tried in order (first available wins):
-      1. sentence-transformers  -> real neural sentence embeddings
+      1. sentence-transformers  -> real neural sentence embeddings, pooled
+                                   over fixed-size chunks of the full text
       2. scikit-learn TF-IDF    -> bag-of-words baseline, zero network, always runs
 
     Swap in any embedding API (OpenAI, Voyage, etc.) by implementing one
     function that maps list[str] -> list[vector]; nothing else changes.
+
+    knn_adjacency() turns the vectors into the k-NN graph every caller uses
+    (temporal_network, controls, visualize), in memory-bounded row blocks.
+    KNN_BACKEND=lsh swaps the exact search for random-projection LSH at
+    corpus scale (RESEARCH-PROGRAM S4/S5); knn_recall() checks what it lost.
+
+    Embeddings persist in EMBED_CACHE_DIR, keyed by text hash + backend +
+    model/vectorizer parameters, so repeat runs and parameter sweeps encode
+    the corpus once: neural vectors as a memory-mapped .npy, TF-IDF as the
+    feature store tfidf_features() shares with analyze/controls/visualize.
 '''
 
+import functools
+import hashlib
+import json
+import os
+
 import numpy as np
+from scipy import sparse
 
+from constants import shelved_books
 
-def _embed_sentence_transformers(texts):
+ST_MODEL = "all-MiniLM-L6-v2"
+ST_CHUNK = "tokens"        # chunking scheme, part of the cache key (see _chunks)
+ST_POOL = os.environ.get("ST_POOL", "mean")     # chunk vectors -> one per book
+ST_BATCH = int(os.environ.get("ST_BATCH", "32"))          # chunks per forward pass
+ST_THREADS = int(os.environ.get("ST_THREADS", "0"))       # torch threads; 0 = default
+TFIDF_PARAMS = dict(stop_words="english", max_features=20000,
+                    min_df=3, max_df=0.4, sublinear_tf=True)
+EMBED_CACHE_DIR = os.path.join(shelved_books, "embedding_cache")   # None = off
+
+# k-NN graphs are built a block of rows at a time; this caps the similarity
+# block (float64 product + float32 copy) held in memory at once.
+KNN_MEMORY_MB = 512
+KNN_BACKEND = os.environ.get("KNN_BACKEND", "exact")
+                           # "exact" -> every pair compared (published runs)
+                           # "lsh"   -> random-projection LSH candidates only
+LSH_TABLES = 12            # independent hash tables; more = higher recall
+LSH_BUCKET = 128           # target books per bucket; sets the bits per hash
+
+
+@functools.lru_cache(maxsize=None)
+def _sentence_model(name):
+    '''One SentenceTransformer per process, not one per embed() call.'''
     from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    return np.asarray(model.encode(texts, normalize_embeddings=True))
+    if ST_THREADS:
+        import torch
+        torch.set_num_threads(ST_THREADS)
+    return SentenceTransformer(name)
+
+
+def _chunks(texts, tokenizer, budget):
+    '''(text index, chunk) pairs: each text cut into pieces of at most `budget`
+    tokenizer tokens (the model's max_seq_length less [CLS]/[SEP]), so nothing
+    past the window is truncated. Cuts fall on word starts, where re-tokenizing
+    a piece gives back exactly its tokens; a single word longer than the
+    budget is the only thing cut mid-word.'''
+    for i, t in enumerate(texts):
+        enc = tokenizer(t, add_special_tokens=False, return_offsets_mapping=True)
+        offsets, words = enc["offset_mapping"], enc.word_ids()
+        if not offsets:
+            yield i, t
+            continue
+        start = 0
+        while start < len(offsets):
+            end = min(start + budget, len(offsets))
+            if end < len(offsets):
+                back = end                     # step back to the cut word's start
+                while back > start and words[back - 1] == words[end]:
+                    back -= 1
+                end = back if back > start else end
+            yield i, t[offsets[start][0]:offsets[end - 1][1]]
+            start = end
+
+
+def _embed_sentence_transformers(texts):
+    model = _sentence_model(ST_MODEL)
+    out = None
+    count = np.zeros(len(texts))
+    owner, batch = [], []
+
+    def flush():
+        nonlocal out
+        E = np.asarray(model.encode(batch, batch_size=ST_BATCH,
+                                    normalize_embeddings=True), dtype=np.float64)
+        if out is None:
+            out = np.full((len(texts), E.shape[1]),
+                          -np.inf if ST_POOL == "max" else 0.0)
+        if ST_POOL == "max":
+            np.maximum.at(out, owner, E)
+        else:
+            np.add.at(out, owner, E)
+        np.add.at(count, owner, 1)
+        owner.clear(); batch.clear()
+
+    # Chunks stream through in batches of ST_BATCH, so peak memory is one
+    # batch of chunk vectors plus the (n, d) pooled result.
+    for i, chunk in _chunks(texts, model.tokenizer, model.max_seq_length - 2):
+        owner.append(i); batch.append(chunk)
+        if len(batch) == ST_BATCH:
+            flush()
+    if batch:
+        flush()
+    if ST_POOL != "max":
+        out /= count[:, None]
+    return (out / np.clip(np.linalg.norm(out, axis=1, keepdims=True),
+                          1e-9, None)).astype(np.float32)
 
 
 def _embed_tfidf(texts):
-    from sklearn.feature_extraction.text import TfidfVectorizer
+    return tfidf_features(texts)[0]
+
+
+def tfidf_features(texts):
+    '''The shared TF-IDF feature store: (X, terms) for this exact corpus, X the
+    CSR document-term matrix. Fitted once, then saved with its vocabulary and
+    IDF as one .npz in EMBED_CACHE_DIR (keyed by vectorizer parameters + text
+    hashes); analyze, controls and visualize all load it from there.'''
+    texts = [t if t else "" for t in texts]
+    path = None
+    if EMBED_CACHE_DIR:
+        key = _digest([TFIDF_PARAMS, [_text_hash(t) for t in texts]])
+        path = os.path.join(EMBED_CACHE_DIR, f"tfidf-{key[:16]}.npz")
+        if os.path.isfile(path):
+            with np.load(path) as z:
+                X = sparse.csr_matrix((z["data"], z["indices"], z["indptr"]),
+                                      shape=tuple(z["shape"]))
+                return X, z["terms"].astype(object)
+
     # The signal is DISTINCTIVE vocabulary, not shared "novel-ese". max_df=0.4
     # drops words common to >40% of books (said, man, eyes, time...) that
     # otherwise make every novel look similar; min_df=3 drops one-off proper
     # nouns (character names) that link books for incidental reasons.
-    vecs = TfidfVectorizer(stop_words="english", max_features=20000,
-                           min_df=3, max_df=0.4,
-                           sublinear_tf=True).fit_transform(texts)
-    # L2-normalize rows so dot product == cosine similarity
-    arr = vecs.toarray().astype(np.float32)
-    norms = np.linalg.norm(arr, axis=1, keepdims=True)
-    norms[norms == 0] = 1.0
-    return arr / norms
+    # Rows come back L2-normalized (norm="l2"), so dot product == cosine
+    # similarity. The matrix stays CSR: memory tracks the non-zeros, not the
+    # 20k-term vocabulary.
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    V = TfidfVectorizer(**TFIDF_PARAMS)
+    X = V.fit_transform(texts).astype(np.float32)
+    terms = np.array(V.get_feature_names_out())
+    if path:
+        os.makedirs(EMBED_CACHE_DIR, exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, data=X.data, indices=X.indices, indptr=X.indptr,
+                     shape=np.array(X.shape), terms=terms.astype(str), idf=V.idf_)
+        os.replace(tmp, path)
+    return X, terms
+
+
+# --- on-disk embedding cache ------------------------------------------------
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _save_npy(path, arr):
+    '''np.save via a temp file, so a killed run never leaves half an array.'''
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _cached_per_text(texts, backend, params, encode):
+    '''Embeddings that depend only on their own text (neural encoders): one
+    memory-mapped (n, d) store per backend + params, rows keyed by text
+    hash. Only texts not seen before are encoded and appended.'''
+    if not EMBED_CACHE_DIR:
+        return encode(texts)
+    stem = os.path.join(EMBED_CACHE_DIR, f"{backend}-{_digest(params)[:16]}")
+    keys = []
+    if os.path.isfile(stem + ".keys.json"):
+        keys = json.load(open(stem + ".keys.json", encoding="utf-8"))
+    row = {h: i for i, h in enumerate(keys)}
+    hashes = [_text_hash(t) for t in texts]
+    todo = {h: t for h, t in zip(hashes, texts) if h not in row}
+    store = np.load(stem + ".npy", mmap_mode="r") if keys else None
+
+    if todo:
+        new = np.asarray(encode(list(todo.values())), dtype=np.float32)
+        store = new if store is None else np.concatenate([store[:len(keys)], new])
+        keys += list(todo)
+        os.makedirs(EMBED_CACHE_DIR, exist_ok=True)
+        _save_npy(stem + ".npy", store)             # rows first, then their keys
+        json.dump(keys, open(stem + ".keys.json", "w", encoding="utf-8"))
+        row = {h: i for i, h in enumerate(keys)}
+    return np.asarray(store[[row[h] for h in hashes]])
 
 
 def embed(texts):
-    '''list[str] -> (n, d) L2-normalized matrix. Picks the best backend present.'''
+    '''list[str] -> (n, d) L2-normalized matrix (dense, or CSR for TF-IDF).
+    Picks the best backend present; reuses cached vectors where it can.'''
     texts = [t if t else "" for t in texts]
     try:
-        return _embed_sentence_transformers(texts), "sentence-transformers"
-    except Exception:
+        _sentence_model(ST_MODEL)
+    except (ImportError, OSError):      # not installed, or the model won't load
         return _embed_tfidf(texts), "tfidf"
+    # Past this point a failure is an error, not a reason to switch backends:
+    # a bad cache file or a full disk must not quietly turn every downstream
+    # graph into a TF-IDF one.
+    return (_cached_per_text(texts, "sentence-transformers",
+                             [ST_MODEL, ST_CHUNK, ST_POOL],
+                             _embed_sentence_transformers),
+            "sentence-transformers")
 
 
 def attach_embeddings(books):
     '''
     books: list of dicts each with a "description" (and "title").
-    Mutates each dict, adding a normalized "vec". Returns the backend name.
+    Mutates each dict, adding a normalized "vec" (a 1 x d CSR row under the
+    TF-IDF backend). Returns the backend name.
     Embeds the whole corpus once so vectors are comparable across all years.
     '''
     texts = [b.get("description") or b.get("title", "") for b in books]
     matrix, backend = embed(texts)
-    for b, v in zip(books, matrix):
-        b["vec"] = v
+    rows = matrix.tocsr() if sparse.issparse(matrix) else matrix
+    for i, b in enumerate(books):
+        b["vec"] = rows[i]
     return backend
 
 
+def stack(vecs):
+    '''Per-book "vec"s -> one (n, d) matrix, CSR if the rows are sparse.'''
+    if vecs and sparse.issparse(vecs[0]):
+        return sparse.vstack(vecs, format="csr")
+    return np.vstack(vecs)
+
+
 def semantic_overlap(a, b):
     '''Cosine similarity between two books' description vectors (in [0, 1]).'''
     va, vb = a.get("vec"), b.get("vec")
     if va is None or vb is None:
         return 0.0
+    if sparse.issparse(va):
+        return float(va.multiply(vb).sum())
     return float(np.dot(va, vb))
+
+
+# --- k-NN graph building ------------------------------------------------------
+def similarity(A, B):
+    '''Dot products of two row sets, accumulated in float64 and rounded to
+    float32. BLAS sums in a different order for a full M @ M.T than for a
+    block of rows, and at float32 that shifts the last bit of a similarity
+    between engines - enough to swap two near-tied neighbours and so the
+    edge order Louvain sees. Rounding a float64 sum makes a pair's value
+    independent of the block it was computed in. Sparse rows are multiplied
+    as sparse and only the (rows, n) result is made dense.'''
+    if sparse.issparse(A) or sparse.issparse(B):
+        S = _as64(A) @ _as64(B).T
+        return (S.toarray() if sparse.issparse(S) else np.asarray(S)).astype(np.float32)
+    return (np.asarray(A, np.float64) @ np.asarray(B, np.float64).T).astype(np.float32)
+
+
+def _as64(M):
+    '''float64 copy of a row matrix, keeping CSR rows sparse.'''
+    if sparse.issparse(M):
+        return sparse.csr_matrix(M, dtype=np.float64)
+    return np.asarray(M, np.float64)
+
+
+def knn_neighbors(sims, k):
+    '''Row-wise k nearest neighbours of a (rows, n) similarity block whose
+    self-similarities the caller has already masked. Each row is ordered by
+    descending similarity, ties going to the lower index, so any engine that
+    finds the same top-k emits the same graph, edge for edge.'''
+    n = sims.shape[1]
+    kth = np.partition(sims, n - k, axis=1)[:, n - k]     # k-th largest per row
+    out = np.empty((sims.shape[0], k), dtype=np.int64)
+    for i in range(sims.shape[0]):
+        cand = np.flatnonzero(sims[i] >= kth[i])
+        out[i] = cand[np.lexsort((cand, -sims[i, cand]))[:k]]
+    return out
+
+
+def _exact_rows(M, rows, k, memory_mb):
+    '''Exact top-k (neighbours, similarities) for the given rows of M.'''
+    n = M.shape[0]
+    nbr = np.empty((len(rows), k), dtype=np.int64)
+    sim = np.empty((len(rows), k), dtype=np.float32)
+    step = max(1, int(memory_mb * 2 ** 20) // (12 * n))
+    for lo in range(0, len(rows), step):
+        block = rows[lo:lo + step]
+        S = similarity(M[block], M)
+        S[np.arange(len(block)), block] = -np.inf    # not your own neighbour
+        nbr[lo:lo + step] = knn_neighbors(S, k)
+        sim[lo:lo + step] = np.take_along_axis(S, nbr[lo:lo + step], axis=1)
+    return nbr, sim
+
+
+def _lsh_rows(M, k, memory_mb, seed=0):
+    '''Approximate top-k per row: candidates are the rows that share a
+    random-hyperplane hash bucket in any of LSH_TABLES tables, scored exactly.
+    Rows that gather fewer than k candidates fall back to the exact search.'''
+    n, d = M.shape
+    rng = np.random.default_rng(seed)
+    bits = int(np.clip(np.round(np.log2(n / LSH_BUCKET)), 1, 62))
+    powers = 1 << np.arange(bits, dtype=np.int64)
+
+    I = np.empty(0, np.int64)                      # running candidate lists
+    J = np.empty(0, np.int64)
+    V = np.empty(0, np.float32)
+    for _ in range(LSH_TABLES):
+        codes = ((M @ rng.standard_normal((d, bits))) > 0) @ powers
+        order = np.argsort(codes, kind="stable")
+        cuts = np.flatnonzero(np.diff(codes[order])) + 1
+        ti, tj, tv = [I], [J], [V]
+        for bucket in np.split(order, cuts):
+            # an oversized bucket is scored in LSH_BUCKET * 4 slices; each
+            # row keeps only its k best from a slice
+            for lo in range(0, len(bucket), LSH_BUCKET * 4):
+                b = bucket[lo:lo + LSH_BUCKET * 4]
+                if len(b) < 2:
+                    continue
+                S = similarity(M[b], M[b])
+                np.fill_diagonal(S, -np.inf)
+                kb = min(k, len(b) - 1)
+                j = np.argpartition(-S, kb - 1, axis=1)[:, :kb]
+                ti.append(np.repeat(b, kb)); tj.append(b[j].ravel())
+                tv.append(np.take_along_axis(S, j, axis=1).ravel())
+        I, J, V = np.concatenate(ti), np.concatenate(tj), np.concatenate(tv)
+
+        # dedupe pairs found by several tables, then keep k per row in
+        # knn_neighbors' order (descending similarity, ties to lower index)
+        _, first = np.unique(I * n + J, return_index=True)
+        I, J, V = I[first], J[first], V[first]
+        order = np.lexsort((J, -V, I))
+        I, J, V = I[order], J[order], V[order]
+        starts = np.searchsorted(I, I, side="left")
+        keep = np.arange(len(I)) - starts < k
+        I, J, V = I[keep], J[keep], V[keep]
+
+    counts = np.bincount(I, minlength=n)
+    nbr = np.full((n, k), -1, dtype=np.int64)
+    sim = np.full((n, k), -np.inf, dtype=np.float32)
+    pos = np.arange(len(I)) - np.searchsorted(I, I, side="left")
+    nbr[I, pos], sim[I, pos] = J, V
+    short = np.flatnonzero(counts < k)
+    if len(short):
+        nbr[short], sim[short] = _exact_rows(M, short, k, memory_mb)
+    return nbr, sim
+
+
+def knn_adjacency(M, k, memory_mb=KNN_MEMORY_MB, backend=None):
+    '''(n, d) row vectors -> sparse (n, n) adjacency holding each row's k
+    most-similar other rows (k capped at n - 1), valued by similarity and
+    stored in knn_neighbors' order. The exact backend computes similarities
+    a block of rows at a time under `memory_mb`, so the dense n x n matrix
+    never exists; backend "lsh" (default: KNN_BACKEND) only scores pairs
+    that share a hash bucket.'''
+    M = _as64(M)                                  # cast once, not per block
+    n = M.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return sparse.csr_matrix((n, n), dtype=np.float32)
+    if (backend or KNN_BACKEND) == "lsh":
+        nbr, sim = _lsh_rows(M, k, memory_mb)
+    else:
+        nbr, sim = _exact_rows(M, np.arange(n), k, memory_mb)
+    return sparse.csr_matrix((sim.ravel(), nbr.ravel(), np.arange(0, n * k + 1, k)),
+                             shape=(n, n))
+
+
+def knn_recall(M, A, sample=1000, seed=0, memory_mb=KNN_MEMORY_MB):
+    '''recall@k of adjacency A against the exact search, over up to `sample`
+    random rows: the share of their true k nearest neighbours A contains.'''
+    M = _as64(M)
+    n = M.shape[0]
+    k = A.indptr[1] - A.indptr[0] if n else 0
+    if k <= 0:
+        return 1.0
+    rows = np.sort(np.random.default_rng(seed).choice(n, min(sample, n), replace=False))
+    exact, _ = _exact_rows(M, rows, k, memory_mb)
+    found = sum(len(np.intersect1d(exact[r], A.indices[A.indptr[i]:A.indptr[i + 1]]))
+                for r, i in enumerate(rows))
+    return found / (len(rows) * k)
+
+
+def knn_edges(A):
+    '''(i, j) pairs of a knn_adjacency matrix, row by row in neighbour order.'''
+    for i in range(A.shape[0]):
+        for j in A.indices[A.indptr[i]:A.indptr[i + 1]]:
+            yield i, int(j)
@@ -0,0 +1,88 @@
+'''
+    Author: Aidan Jude
+    Sequential Monte Carlo for the project's null-model tests.
+
+    permutation_z (build_influence_graph, stylistic_by_representation) and
+    concentration_z (controls, subcluster_emergence) all estimate
+    z = (observed - mean null) / sd null from a fixed number of random draws.
+    Most of those tests are settled long before the last draw: z ~ 9 or
+    z ~ 0 after a few hundred trials is not going to cross a threshold in
+    the next four thousand.
+
+    run_null() draws the null in batches and stops as soon as either
+      - every decision the caller will make is settled: the z estimate sits
+        more than STOP_CONFIDENCE's worth of standard errors away from each
+        of the caller's `thresholds` - the z values its calls turn on, one
+        per side tested (controls' one-sided z <= -2.0 is (-2.0,), a
+        two-sided |z| >= 1.96 is (-1.96, 1.96)), or
+      - the z estimate is known to within `precision` (one standard error),
+    and returns only the draws it made, so every caller can report the
+    trials actually used. The standard error of z from N draws is the
+    delta-method sqrt((1 + z^2/2) / N).
+
+    With neither set (the default) it is a single full-length draw, so the
+    published, seeded results are unchanged. Draws come from the same stream
+    in both modes: a stopped run is a prefix of the full one.
+
+    Env:  NULL_STOP_DECISION=1       stop once the caller's decisions are settled
+          NULL_STOP_PRECISION=0.1    stop once z is known to +/- 0.1
+'''
+
+import math
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+
+def _env_float(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+STOP_DECISION = os.environ.get("NULL_STOP_DECISION") == "1"   # off -> full run
+STOP_PRECISION = _env_float("NULL_STOP_PRECISION")      # None -> full run
+STOP_BATCH = 200           # trials drawn between stopping checks
+STOP_CONFIDENCE = 0.999    # how sure a stopped decision must be
+
+
+def decision_bars(*bars):
+    '''`thresholds` for run_null: the caller's decision z values when
+    NULL_STOP_DECISION is on, none (never stop on a decision) otherwise.'''
+    return tuple(bars) if STOP_DECISION else ()
+
+
+def z_stderr(z, n):
+    '''Standard error of a z estimated from n null draws (delta method).'''
+    return math.sqrt((1.0 + z * z / 2.0) / n)
+
+
+def settled(z, n, thresholds=(), precision=None):
+    '''True once n draws pin z down enough: clear of every threshold, or
+    within precision.'''
+    se = z_stderr(z, n)
+    if precision is not None and se <= precision:
+        return True
+    if thresholds:
+        margin = NormalDist().inv_cdf(1 - (1 - STOP_CONFIDENCE) / 2) * se
+        return all(abs(z - bar) > margin for bar in thresholds)
+    return False
+
+
+def run_null(draw, observed, trials, thresholds=(), precision=None,
+             batch=STOP_BATCH):
+    '''Null statistics from draw(k) -> k draws, at most `trials` of them.
+    With no thresholds/precision this is just draw(trials); otherwise draws
+    come `batch` at a time until settled(). len(result) is the trials used.'''
+    if not thresholds and precision is None:
+        return np.asarray(draw(trials), dtype=float)
+    parts, n = [], 0
+    while n < trials:
+        parts.append(np.asarray(draw(min(batch, trials - n)), dtype=float))
+        n += len(parts[-1])
+        null = np.concatenate(parts)
+        sd = null.std()
+        if sd > 0 and settled((observed - null.mean()) / sd, n, thresholds,
+                              precision):
+            break
+    return np.concatenate(parts)
@@ -45,7 +45,8 @@
     the candidate pool is restricted to the bin.
 
     DATA PROVENANCE
-    _data/influence_graph.json is a checked-in artifact of a real run. Its 2,915
+    _data/influence_graph.json (edge columns in influence_edges.npz) is a
+    checked-in artifact of a real run. Its 2,915
     directed edges cover essentially every forward author pair (77 authors ->
     2,926 possible), so the similarity matrices are reconstructed from it
     exactly rather than recomputed from prose.
@@ -83,12 +84,18 @@
     Run:  python stylistic_by_representation.py -> stylistic_representation.json
 '''
 
+import hashlib
 import json
 import os
 
 import numpy as np
 
+from build_influence_graph import SIGNIFICANT_Z, ForwardPairs, load_influence_graph
+from sequential_null import STOP_DECISION, STOP_PRECISION, decision_bars, run_null
+
 GRAPH = "_data/influence_graph.json"
+EDGES = "_data/influence_edges.npz"
+MATRIX_CACHE = "_data/influence_matrices.npz"   # load_graph's cache, rebuilt on change
 KNOWN = "_data/known_influences.json"
 WIKIDATA = "_data/wikidata_influences.json"
 OUT = "stylistic_representation.json"
@@ -98,21 +105,47 @@ N_BINS = 4
 SEED = 0
 
 
+def _graph_digest():
+    '''Hash of the graph files' bytes - cheap next to parsing them.'''
+    h = hashlib.sha256()
+    for path in (GRAPH, EDGES):
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
 def load_graph():
-    g = json.load(open(GRAPH, encoding="utf-8"))
+    '''Authors plus the symmetric stylistic/conceptual matrices (NaN where
+    no edge), filled from the edge columns by fancy-index. The result is
+    cached in MATRIX_CACHE, keyed by the graph files' hash, so reruns never
+    parse the graph at all.'''
+    digest = _graph_digest()
+    if os.path.isfile(MATRIX_CACHE):
+        with np.load(MATRIX_CACHE) as z:
+            if str(z["digest"]) == digest:
+                names = z["names"].tolist()
+                return (names, {n: i for i, n in enumerate(names)}, z["years"],
+                        z["nbooks"], z["styl"], z["conc"])
+
+    g, edges = load_influence_graph(GRAPH)
     names = [a["name"] for a in g["authors"]]
-    idx = {n: i for i, n in enumerate(names)}
     years = np.array([a["earliest_year"] for a in g["authors"]], dtype=float)
     nbooks = np.array([a["n_books_used"] for a in g["authors"]], dtype=float)
 
     n = len(names)
+    i, j = edges["from"], edges["to"]
     styl = np.full((n, n), np.nan)
     conc = np.full((n, n), np.nan)
-    for e in g["edges"]:
-        i, j = idx[e["from"]], idx[e["to"]]
-        styl[i, j] = styl[j, i] = e["stylistic"]
-        conc[i, j] = conc[j, i] = e["conceptual"]
-    return names, idx, years, nbooks, styl, conc
+    styl[i, j] = styl[j, i] = edges["stylistic"]
+    conc[i, j] = conc[j, i] = edges["conceptual"]
+
+    tmp = MATRIX_CACHE + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, digest=digest, names=np.array(names, dtype=str), years=years,
+                 nbooks=nbooks, styl=styl, conc=conc)
+    os.replace(tmp, MATRIX_CACHE)
+    return names, {n: i for i, n in enumerate(names)}, years, nbooks, styl, conc
 
 
 def load_pairs(path, idx, years):
@@ -125,25 +158,36 @@ def load_pairs(path, idx, years):
             and years[idx[r["from"]]] < years[idx[r["to"]]]]
 
 
-def permutation_z(real_vals, cand_i, cand_j, sim, rng, trials=TRIALS):
-    '''build_influence_graph.permutation_z, with a restricted candidate pool.'''
+def permutation_z(real_vals, candidates, sim, rng, trials=TRIALS,
+                  thresholds=decision_bars(-SIGNIFICANT_Z, SIGNIFICANT_Z),
+                  precision=STOP_PRECISION):
+    '''build_influence_graph.permutation_z, with a restricted candidate pool:
+    `candidates` is a ForwardPairs over the bin or subset. Candidate pairs
+    with no similarity (NaN) are redrawn, so the null stays uniform over the
+    pairs that have one.'''
     real_vals = np.asarray([v for v in real_vals if not np.isnan(v)], float)
-    if len(real_vals) == 0 or len(cand_i) == 0:
-        return None
-    pool = sim[cand_i, cand_j]
-    pool = pool[~np.isnan(pool)]
-    if len(pool) == 0:
+    if len(real_vals) == 0 or candidates.count == 0:
         return None
+    if all(np.isnan(sim[i, candidates.later(i)]).all() for i in candidates.rows()):
+        return None                        # no pair in the pool has a value
     real_mean = float(real_vals.mean())
-    null_means = np.array([pool[rng.choice(len(pool), size=len(real_vals),
-                                           replace=True)].mean()
-                           for _ in range(trials)])
+
+    def draw(k):
+        vals = sim[candidates.sample(rng, (k, len(real_vals)))]
+        bad = np.isnan(vals)
+        while bad.any():
+            vals[bad] = sim[candidates.sample(rng, int(bad.sum()))]
+            bad = np.isnan(vals)
+        return vals.mean(axis=1)
+
+    null_means = run_null(draw, real_mean, trials, thresholds, precision)
     z = (real_mean - null_means.mean()) / (null_means.std() + 1e-12)
     return {"real_mean": round(real_mean, 4),
             "null_mean": round(float(null_means.mean()), 4),
             "null_std": round(float(null_means.std()), 4),
             "diff": round(real_mean - float(null_means.mean()), 4),
-            "z": round(float(z), 3), "n_pairs": int(len(real_vals))}
+            "z": round(float(z), 3), "n_pairs": int(len(real_vals)),
+            "trials": len(null_means)}
 
 
 def main():
@@ -159,10 +203,6 @@ def main():
     print(f"books per author (n_books_used): min {nbooks.min():.0f} "
           f"median {np.median(nbooks):.0f} max {nbooks.max():.0f}\n")
 
-    # forward-chronology candidate pool, as in the original test
-    ci, cj = np.where(years[:, None] < years[None, :])
-    cand_min = np.minimum(nbooks[ci], nbooks[cj])
-
     pair_i = np.array([idx[a] for a, _ in pairs])
     pair_j = np.array([idx[b] for _, b in pairs])
     pair_min = np.minimum(nbooks[pair_i], nbooks[pair_j])
@@ -174,7 +214,9 @@ def main():
     print(f"bin edges on min(n_books_used): {edges}\n")
 
     report = {"meta": {"n_authors": len(names), "n_pairs": len(pairs),
-                       "trials": TRIALS, "bin_edges": edges}, "bins": []}
+                       "trials": TRIALS, "bin_edges": edges,
+                       "stop_decision": STOP_DECISION,
+                       "stop_precision": STOP_PRECISION}, "bins": []}
 
     hdr = (f"{'bin (min books)':<18}{'n':>5}   "
            f"{'STYLISTIC real':>15}{'null':>9}{'diff':>9}{'z':>8}   "
@@ -184,13 +226,17 @@ def main():
     for lo, hi in zip(edges[:-1], edges[1:]):
         last = hi == edges[-1]
         sel = (pair_min >= lo) & (pair_min <= hi if last else pair_min < hi)
-        pool = (cand_min >= lo) & (cand_min <= hi if last else cand_min < hi)
         if sel.sum() < 5:
             continue
+        # forward-chronology candidates with min(n_books) in the bin: both
+        # authors >= lo, and not both past hi (> hi for the closed last bin).
+        low = nbooks >= lo
+        high = nbooks > hi if last else nbooks >= hi
+        pool = ForwardPairs(years, [(low & ~high, low), (high, low & ~high)])
         row = {"lo": int(lo), "hi": int(hi), "n_pairs": int(sel.sum())}
         for key, sim in (("stylistic", styl), ("conceptual", conc)):
             vals = sim[pair_i[sel], pair_j[sel]]
-            row[key] = permutation_z(vals, ci[pool], cj[pool], sim, rng)
+            row[key] = permutation_z(vals, pool, sim, rng)
         s, c = row["stylistic"], row["conceptual"]
         label = f"{lo}-{hi}" if not last else f"{lo}+"
         print(f"{label:<18}{row['n_pairs']:>5}   "
@@ -213,12 +259,11 @@ def main():
         ok = keep[pair_i] & keep[pair_j]
         if ok.sum() < 5:
             continue
-        pool = keep[ci] & keep[cj]
+        pool = ForwardPairs(years, [(keep, keep)])
         row = {"threshold": t, "n_authors": int(keep.sum()),
                "n_pairs": int(ok.sum())}
         for key, sim in (("stylistic", styl), ("conceptual", conc)):
-            row[key] = permutation_z(sim[pair_i[ok], pair_j[ok]],
-                                     ci[pool], cj[pool], sim, rng)
+            row[key] = permutation_z(sim[pair_i[ok], pair_j[ok]], pool, sim, rng)
         s, c = row["stylistic"], row["conceptual"]
         print(f"{t:>3}{row['n_authors']:>9}{row['n_pairs']:>7}   "
               f"{s['diff']:>10.4f}{s['z']:>8.2f}   {c['diff']:>10.4f}{c['z']:>8.2f}")
@@ -227,12 +272,20 @@ def main():
 
     # Continuous check, free of any binning choice: does a pair's stylistic
     # excess over its own book-count baseline grow with representation?
-    base = {}
-    for m in np.unique(cand_min):
-        v = styl[ci[cand_min == m], cj[cand_min == m]]
-        v = v[~np.isnan(v)]
-        base[m] = v.mean() if len(v) else np.nan
-    excess = np.array([styl[i, j] - base.get(m, np.nan)
+    # The baselines accumulate one author's forward pairs at a time, so no
+    # pair list is built here either.
+    sums = np.zeros(int(nbooks.max()) + 1)
+    counts = np.zeros_like(sums)
+    for i in range(len(names)):
+        later = years > years[i]
+        v = styl[i, later]
+        m = np.minimum(nbooks[i], nbooks[later]).astype(int)
+        good = ~np.isnan(v)
+        sums += np.bincount(m[good], v[good], len(sums))
+        counts += np.bincount(m[good], minlength=len(sums))
+    with np.errstate(invalid="ignore"):
+        base = sums / counts                   # NaN where no candidate pair
+    excess = np.array([styl[i, j] - base[int(m)]
                        for i, j, m in zip(pair_i, pair_j, pair_min)])
     ok = ~np.isnan(excess)
     from scipy.stats import spearmanr
@@ -77,26 +77,56 @@
         discovery. That is a quantified limit on the corpus, not on the method.
 
     Run:  python subcluster_emergence.py   ->   subcluster_results.json
+          SUBCLUSTER_SWEEP=dendrogram cuts one CommunityDendrogram per seed at
+          every resolution instead of re-running Louvain at each - a fast
+          approximation with somewhat lower modularity, not the published
+          partitions.
+          SUBCLUSTER_NULL=spawned computes every distinct community's z on the
+          process pool, each from its own SeedSequence stream keyed by the
+          member set - independent of order and worker count, and the way to
+          afford 100+ seeds. NULL_TABLE=1 takes each z from controls.null_table's
+          shared per-size null instead. Either way the draws differ from the
+          published single stream, so z moves by ~0.05 and the figures above
+          are not reproduced (detective -> -2.92 spawned, -2.99 under the tables).
 '''
 
+import heapq
 import json
 import os
 import sys
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import networkx as nx
 import networkx.algorithms.community as nxc
 
+# controls.py's own test, imported rather than copied: the whole point is that
+# the sub-clusters are judged by exactly the test the parent clusters were.
+from controls import EMERGENT_Z, NULL_TABLE, NULL_TRIALS, concentration_z
+from sequential_null import decision_bars
+
 SRC = "genre_network.html"
 OUT = "subcluster_results.json"
 
 MIN_COMMUNITY = 5            # controls.py's own floor
-NULL_TRIALS = 3000           # controls.py's own trial count
 RESOLUTIONS = [1.0, 1.25, 1.5, 1.75, 2.0, 2.5, 3.0]
-SEEDS = list(range(10))
+SEEDS = list(range(int(os.environ.get("SUBCLUSTER_SEEDS", "10"))))
+WORKERS = None               # process-pool size for the resolution x seed grid
+SWEEP = os.environ.get("SUBCLUSTER_SWEEP", "louvain")
+                             # "louvain"    -> a Louvain run per resolution (published)
+                             # "dendrogram" -> one CommunityDendrogram per seed, cut
+                             #   (faster; up to ~6% lower modularity than Louvain)
+NULL = os.environ.get("SUBCLUSTER_NULL", "stream")
+                             # "stream"  -> one default_rng(0) walked community by
+                             #              community, in the parent (published)
+                             # "spawned" -> a SeedSequence stream per member set, on
+                             #              the pool (NULL_TABLE=1 overrides both)
 JACCARD_MATCH = 0.5          # membership overlap that counts as "the same"
 ALPHA = 0.05
+MINHASH_PERMS = 32           # group_recurring(index="minhash") signature length
+MINHASH_BANDS = 16           # 2 rows per band: a Jaccard-0.5 pair collides w.p. ~0.99
+_PRIME = (1 << 31) - 1
 
 
 def extract_data(path):
@@ -116,14 +146,6 @@ def extract_data(path):
     raise RuntimeError(f"couldn't find embedded DATA in {path}")
 
 
-def concentration_z(member_years, all_years, rng, trials=NULL_TRIALS):
-    '''Verbatim from controls.py. Do not "improve" it - the whole point is that
-    the sub-clusters are judged by exactly the test the parent clusters were.'''
-    draws = [all_years[rng.choice(len(all_years), len(member_years),
-             replace=False)].std() for _ in range(trials)]
-    return (member_years.std() - np.mean(draws)) / np.std(draws)
-
-
 def bonferroni_z(n_tests, alpha=ALPHA):
     '''One-sided z threshold for `n_tests` comparisons. Concentration is a
     one-sided question: we only care about clusters TIGHTER than chance.'''
@@ -139,22 +161,72 @@ def jaccard(a, b):
     return len(a & b) / len(a | b)
 
 
-def group_recurring(runs):
+def _minhash_keys(core, salt):
+    '''LSH bucket keys of a member set: MINHASH_PERMS min-hashes, banded.'''
+    x = np.fromiter(core, dtype=np.int64)
+    sig = ((salt[0][:, None] * x[None, :] + salt[1][:, None]) % _PRIME).min(axis=1)
+    rows = MINHASH_PERMS // MINHASH_BANDS
+    return [(b, sig[b * rows:(b + 1) * rows].tobytes()) for b in range(MINHASH_BANDS)]
+
+
+def group_recurring(runs, index="inverted"):
     '''Match communities across seeds by membership overlap.
 
     runs: list of (seed, frozenset(members)). Returns a list of groups, each a
     list of (seed, members). A group seen in only a few seeds is unstable and
     is reported as such rather than silently dropped.
+
+    A community joins the FIRST group whose core it overlaps by Jaccard >=
+    JACCARD_MATCH. Only groups sharing a member can qualify, so candidates
+    come from an index instead of a scan of every group:
+      "inverted" - node -> groups whose core holds it; overlaps are counted
+                   from it directly. Exact: the same grouping as a scan.
+      "minhash"  - banded MinHash buckets of the cores; candidates are then
+                   checked with the exact Jaccard, so a match is never wrong,
+                   only (rarely) missed. For sweeps of thousands of runs.
     '''
     groups = []
+    where = defaultdict(set)                   # node -> groups whose core has it
+    buckets, keys = defaultdict(set), []       # minhash: bucket -> groups
+    salt = None
+    if index == "minhash":
+        rng = np.random.default_rng(0)
+        salt = (rng.integers(1, _PRIME, MINHASH_PERMS), rng.integers(0, _PRIME, MINHASH_PERMS))
+
+    def register(gid):
+        core = groups[gid]["core"]
+        if index == "minhash":
+            for key in keys[gid]:
+                buckets[key].discard(gid)
+            keys[gid] = _minhash_keys(core, salt)
+            for key in keys[gid]:
+                buckets[key].add(gid)
+        else:
+            for x in core:
+                where[x].add(gid)
+
     for seed, members in runs:
-        for g in groups:
-            if jaccard(g["core"], members) >= JACCARD_MATCH:
-                g["members"].append((seed, members))
-                g["core"] = g["core"] & members or g["core"]
-                break
+        if index == "minhash":
+            cand = set().union(*(buckets[k] for k in _minhash_keys(members, salt)))
+            overlap = {gid: len(groups[gid]["core"] & members) for gid in cand}
         else:
+            overlap = Counter(gid for x in members for gid in where[x])
+        match = min((gid for gid, ov in overlap.items()
+                     if ov / (len(groups[gid]["core"]) + len(members) - ov) >= JACCARD_MATCH),
+                    default=None)
+        if match is None:
             groups.append({"core": set(members), "members": [(seed, members)]})
+            keys.append([])
+            register(len(groups) - 1)
+            continue
+        g = groups[match]
+        g["members"].append((seed, members))
+        # A match shares members, so the core shrinks to a non-empty overlap.
+        for x in g["core"] - members:
+            where[x].discard(match)
+        g["core"] &= members
+        if index == "minhash":
+            register(match)
     return groups
 
 
@@ -172,6 +244,185 @@ def describe(members, years, titles, authors):
     }
 
 
+class CommunityDendrogram:
+    '''One community hierarchy over G, cut at any resolution without
+    re-running Louvain - the agglomerative reading of sub-genres that
+    docs/PROPOSAL.md S4 asks about.
+
+    Bottom: Louvain's own aggregation levels at resolution `finest`, kept
+    (the last is exactly louvain_communities(G, finest, seed)). Above them,
+    communities merge in order of the resolution at which joining them first
+    pays: the modularity gain w_ij/m - gamma d_i d_j / 2m^2 turns positive
+    below gamma* = 2m w_ij / (d_i d_j). Unconnected communities never merge.
+
+    Modularity is a sum over communities, q(c) = L_c/m - gamma (d_c/2m)^2
+    (L internal weight, d degree sum), so the best partition the tree holds
+    at any gamma is one bottom-up pass: a node stays whole unless its
+    children's best scores more.
+
+    That best is only the best THIS tree holds: merges are greedy and fixed,
+    so a cut is an approximation of a fresh Louvain run at that gamma, not a
+    match. On the published graph (10 seeds) cuts score up to ~6% lower
+    modularity than Louvain at gamma 1.0-2.5, typically 1-3%, and match it
+    only at the finest resolution, which is Louvain itself.'''
+
+    def __init__(self, G, finest, seed=None, weight="weight"):
+        nodes = list(G)
+        pos = {x: i for i, x in enumerate(nodes)}
+        n = len(nodes)
+        e = [(pos[a], pos[b], d.get(weight, 1)) for a, b, d in G.edges(data=True)]
+        u = np.array([a for a, _, _ in e], dtype=np.int64)
+        v = np.array([b for _, b, _ in e], dtype=np.int64)
+        w = np.array([c for _, _, c in e], dtype=float)
+        self.m = w.sum()
+        self.members = [frozenset([x]) for x in nodes]
+        self.children = [()] * n
+        self.L = list(np.bincount(u[u == v], w[u == v], n))
+        self.d = list(np.bincount(u, w, n) + np.bincount(v, w, n))
+        self.levels = [list(range(n))]
+
+        label = np.arange(n)
+        for part in nxc.louvain_partitions(G, weight, finest, seed=seed):
+            nxt = np.empty(n, dtype=np.int64)
+            for c in part:
+                idx = [pos[x] for x in c]
+                kids = sorted(set(label[idx].tolist()))
+                nxt[idx] = kids[0] if len(kids) == 1 else self._add(kids, 0.0)
+            inside = (nxt[u] == nxt[v]) & (label[u] != label[v])
+            gained = np.bincount(nxt[u[inside]], w[inside], len(self.L))
+            for t in np.flatnonzero(gained):
+                self.L[t] += gained[t]
+            label = nxt
+            self.levels.append(sorted(set(label.tolist())))
+
+        # agglomerate the top level by descending gamma*
+        cross = label[u] != label[v]
+        W = defaultdict(lambda: defaultdict(float))
+        for a, b, c in zip(label[u[cross]].tolist(), label[v[cross]].tolist(), w[cross]):
+            W[a][b] += c
+            W[b][a] += c
+        heap = [(-self._critical(a, b, W[a][b]), a, b) for a in W for b in W[a] if a < b]
+        heapq.heapify(heap)
+        alive = set(self.levels[-1])
+        while heap:
+            _, a, b = heapq.heappop(heap)
+            if a not in alive or b not in alive:
+                continue
+            t = self._add([a, b], W[a][b])
+            alive -= {a, b}
+            for x in set(W[a]) | set(W[b]):
+                if x in alive:
+                    W[t][x] = W[x][t] = W[a].get(x, 0.0) + W[b].get(x, 0.0)
+                    heapq.heappush(heap, (-self._critical(t, x, W[t][x]), t, x))
+            alive.add(t)
+        self.L, self.d = np.array(self.L), np.array(self.d)
+
+    def _add(self, kids, between):
+        '''New tree node over `kids`, joined by `between` edge weight.'''
+        self.members.append(frozenset().union(*(self.members[k] for k in kids)))
+        self.children.append(tuple(kids))
+        self.L.append(sum(self.L[k] for k in kids) + between)
+        self.d.append(sum(self.d[k] for k in kids))
+        return len(self.members) - 1
+
+    def _critical(self, a, b, w_ab):
+        return 2 * self.m * w_ab / (self.d[a] * self.d[b])
+
+    def communities(self, resolution):
+        '''The highest-modularity partition the tree holds at `resolution`.'''
+        q = self.L / self.m - resolution * (self.d / (2 * self.m)) ** 2
+        best, whole = q.copy(), np.ones(len(q), dtype=bool)
+        for t, kids in enumerate(self.children):      # children precede parents
+            if kids:
+                split = best[list(kids)].sum()
+                if split > q[t]:
+                    best[t], whole[t] = split, False
+        has_parent = np.zeros(len(q), dtype=bool)
+        for kids in self.children:
+            has_parent[list(kids)] = True
+        out, stack = [], list(np.flatnonzero(~has_parent))
+        while stack:
+            t = stack.pop()
+            if whole[t]:
+                out.append(set(self.members[t]))
+            else:
+                stack.extend(self.children[t])
+        return out
+
+    def cut(self, level):
+        '''Louvain's aggregation level `level` (0 = single nodes).'''
+        return [set(self.members[t]) for t in self.levels[level]]
+
+
+_graph = None
+
+
+def _init_worker(G):
+    global _graph
+    _graph = G
+
+
+def _partition(task):
+    '''One seed's communities at each resolution in `gammas`, on the worker's
+    copy of the graph: a Louvain run per resolution, or one dendrogram cut at
+    each.'''
+    gammas, seed, method = task
+    if method == "dendrogram":
+        tree = CommunityDendrogram(_graph, max(gammas), seed)
+        parts = [tree.communities(gamma) for gamma in gammas]
+    else:
+        parts = [nxc.louvain_communities(_graph, resolution=gamma, seed=seed)
+                 for gamma in gammas]
+    return [[frozenset(int(x) for x in c) for c in p if len(c) >= MIN_COMMUNITY]
+            for p in parts]
+
+
+_years = None
+
+
+def _init_null(years):
+    global _years
+    _years = years
+
+
+def _spawned_z(task):
+    '''One community's z from its own stream: SeedSequence(0) spawned along
+    the sorted member ids, so the value depends on the set alone.'''
+    members, bars = task
+    rng = np.random.default_rng(np.random.SeedSequence(0, spawn_key=members))
+    return float(concentration_z(_years[list(members)], _years, rng,
+                                 thresholds=bars))
+
+
+def spawned_zs(keys, years, bars=(), workers=WORKERS):
+    '''{members: z} for every sorted member tuple in `keys`, across a process
+    pool. The years are sent once per worker; each z has its own spawned
+    stream, so the result does not depend on order or worker count.'''
+    keys = sorted(keys)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_null,
+                             initargs=(years,)) as pool:
+        zs = pool.map(_spawned_z, [(k, bars) for k in keys], chunksize=32)
+        return dict(zip(keys, zs))
+
+
+def partition_grid(G, resolutions, seeds, workers=WORKERS, method=SWEEP):
+    '''{(gamma, seed): communities >= MIN_COMMUNITY} for the whole grid, run
+    across a process pool. The graph is sent once per worker, not per task,
+    and each run is fixed by its own (gamma, seed), so the result does not
+    depend on the worker count. method="dendrogram" builds one
+    CommunityDendrogram per seed and cuts it at every resolution.'''
+    if method == "dendrogram":
+        tasks = [(list(resolutions), seed, method) for seed in seeds]
+    else:
+        tasks = [([gamma], seed, method) for gamma in resolutions for seed in seeds]
+    out = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(G,)) as pool:
+        for (gammas, seed, _), parts in zip(tasks, pool.map(_partition, tasks)):
+            out.update({(gamma, seed): p for gamma, p in zip(gammas, parts)})
+    return out
+
+
 def main():
     here = os.path.dirname(os.path.abspath(__file__))
     os.chdir(here)
@@ -191,30 +442,42 @@ def main():
     print(f"null: {NULL_TRIALS} random same-size draws, controls.py's test, "
           f"one-sided\n")
 
-    rng = np.random.default_rng(0)
+    # The published null: one seeded stream, a community's z computed once
+    # however many runs find it, in the order the report first asks for it.
+    # NULL_TABLE=1 swaps in controls.null_table's per-size nulls, shared by
+    # every resolution and seed; SUBCLUSTER_NULL=spawned fills z_cache up
+    # front on the pool. Both are faster, but different draws.
+    null = "table" if NULL_TABLE else NULL
+    rng = None if null == "table" else np.random.default_rng(0)
     z_cache = {}
 
     def cached_z(members):
         key = tuple(sorted(members))
         if key not in z_cache:
-            z_cache[key] = float(concentration_z(years[list(key)], years, rng))
+            z_cache[key] = float(concentration_z(years[list(key)], years, rng,
+                                                 thresholds=bars))
         return z_cache[key]
 
     report = {"resolutions": [], "meta": {
         "n_books": len(books), "n_edges": G.number_of_edges(),
         "min_community": MIN_COMMUNITY, "null_trials": NULL_TRIALS,
-        "seeds": len(SEEDS), "alpha": ALPHA,
+        "seeds": len(SEEDS), "alpha": ALPHA, "sweep": SWEEP,
+        "null": null,
     }}
 
+    partitions = partition_grid(G, RESOLUTIONS, SEEDS)
+    grouped = {gamma: group_recurring([(seed, c) for seed in SEEDS
+                                       for c in partitions[(gamma, seed)]])
+               for gamma in RESOLUTIONS}
+    # A cached z serves every resolution, so an early-stopped null
+    # (NULL_STOP_DECISION=1) must settle the raw bar and every Bonferroni bar.
+    bars = decision_bars(EMERGENT_Z, *{bonferroni_z(len(g)) for g in grouped.values()})
+    if null == "spawned":
+        z_cache.update(spawned_zs({tuple(sorted(m)) for groups in grouped.values()
+                                   for g in groups for _, m in g["members"]},
+                                  years, bars))
     for gamma in RESOLUTIONS:
-        runs = []
-        for seed in SEEDS:
-            comms = nxc.louvain_communities(G, resolution=gamma, seed=seed)
-            for c in comms:
-                if len(c) >= MIN_COMMUNITY:
-                    runs.append((seed, frozenset(int(x) for x in c)))
-
-        groups = group_recurring(runs)
+        groups = grouped[gamma]
         n_tests = len(groups)
         z_crit = bonferroni_z(n_tests)
 
@@ -233,7 +496,7 @@ def main():
                 "seeds_seen": len(g["members"]),
                 "stable": len(g["members"]) >= len(SEEDS) * 0.6,
             })
-            row["significant_raw"] = row["z_median"] <= -2.0
+            row["significant_raw"] = row["z_median"] <= EMERGENT_Z
             row["significant_corrected"] = (row["z_median"] <= z_crit
                                             and row["stable"])
             rows.append(row)
@@ -24,14 +24,21 @@ import json
 import os
 import re
 import csv
+import functools
+import hashlib
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
 
 import numpy as np
 import networkx as nx
 import networkx.algorithms.community as nx_comm
+from scipy import sparse
 
 from constants import shelved_books, untracked_genres
-from semantic_edges import attach_embeddings, semantic_overlap
+import semantic_edges
+from semantic_edges import (attach_embeddings, knn_adjacency, knn_recall,
+                            semantic_overlap, similarity, stack)
 
 # --- tuning knobs -----------------------------------------------------------
 EDGE_METHOD = os.environ.get("EDGE_METHOD", "genre")
@@ -43,8 +50,34 @@ EDGE_MIN_OVERLAP = 0.5     # genre-overlap threshold for an edge (matches paper)
 # threshold yields one blob. Linking each book to its k most-similar peers
 # recovers genre structure robustly regardless of the absolute cosine scale.
 EDGE_KNN = 6
+SEMANTIC_MIN_COSINE = 0.5  # cosine threshold, used only without k-NN (EDGE_KNN = 0,
+                           # or a snapshot too small to have k neighbours)
 MATCH_MIN_JACCARD = 0.3    # how much membership overlap counts as "the same"
                            # community persisting from one year to the next
+COMMUNITY_MODE = os.environ.get("COMMUNITY_MODE", "cold")
+                           # "cold" -> fresh Louvain on every snapshot (published runs)
+                           # "warm" -> start each year from last year's partition
+
+
+@dataclass(frozen=True)
+class TimelineConfig:
+    '''Every knob a mutation timeline depends on, passed explicitly so that
+    analyses with different settings can run side by side in one process.
+    Fields default to the module-level knobs above, read at construction.'''
+    edge_method: str = field(default_factory=lambda: EDGE_METHOD)
+    edge_min_overlap: float = field(default_factory=lambda: EDGE_MIN_OVERLAP)
+    edge_knn: int = field(default_factory=lambda: EDGE_KNN)
+    semantic_min_cosine: float = field(default_factory=lambda: SEMANTIC_MIN_COSINE)
+    match_min_jaccard: float = field(default_factory=lambda: MATCH_MIN_JACCARD)
+    community_mode: str = field(default_factory=lambda: COMMUNITY_MODE)
+    knn_backend: str = field(default_factory=lambda: semantic_edges.KNN_BACKEND)
+    seed: int = 42
+
+    def key(self):
+        '''Stable across processes and runs (unlike hash()), for caching
+        results per configuration.'''
+        blob = json.dumps(asdict(self), sort_keys=True).encode("utf-8")
+        return hashlib.sha256(blob).hexdigest()[:16]
 
 
 # --- 1. load + parse --------------------------------------------------------
@@ -64,7 +97,8 @@ def parse_year(date_published):
     return int(m.group(1)) if m else None
 
 
-def books_by_year(books):
+def books_by_year(books, config=None):
+    config = config or TimelineConfig()
     grouped = defaultdict(list)
     kept = []
     for b in books:
@@ -79,9 +113,15 @@ def books_by_year(books):
 
     # For semantic edges, embed the whole kept corpus once so the vectors are
     # comparable across every year before snapshots are built.
-    if EDGE_METHOD == "semantic" and kept:
+    if config.edge_method == "semantic" and kept:
         backend = attach_embeddings(kept)
-        print(f"Semantic edges via: {backend}\n")
+        print(f"Semantic edges via: {backend}")
+        if config.knn_backend == "lsh" and config.edge_knn:
+            k = config.edge_knn
+            M = stack([b["vec"] for b in kept])
+            recall = knn_recall(M, knn_adjacency(M, k, backend="lsh"))
+            print(f"k-NN via LSH: recall@{k} {recall:.3f} vs exact")
+        print()
     return grouped
 
 
@@ -93,78 +133,266 @@ def genre_overlap(a, b):
     return len(a["genres"] & b["genres"]) / smaller
 
 
-def edge_valid(a, b):
+def edge_valid(a, b, config):
     '''Whether an edge should connect two books, per the selected method.'''
-    if EDGE_METHOD == "semantic":
-        return semantic_overlap(a, b) >= SEMANTIC_MIN_COSINE
-    return genre_overlap(a, b) >= EDGE_MIN_OVERLAP
+    if config.edge_method == "semantic":
+        return semantic_overlap(a, b) >= config.semantic_min_cosine
+    return genre_overlap(a, b) >= config.edge_min_overlap
+
+
+def genre_edges(books, min_overlap, block=2048):
+    '''(i, j) pairs, i < j, whose genre overlap clears min_overlap, in
+    the order the all-pairs loop would visit them. Intersections come from a
+    binary book x genre sparse matrix times its transpose, one row block at
+    a time, and the min(|A|, |B|) denominators from its row sums - so only
+    pairs sharing at least one genre are ever touched.'''
+    vocab = {}
+    rows, cols = [], []
+    for i, b in enumerate(books):
+        for g in b["genres"]:
+            rows.append(i)
+            cols.append(vocab.setdefault(g, len(vocab)))
+    X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                          shape=(len(books), len(vocab)))
+    sizes = np.asarray(X.sum(axis=1)).ravel()
+
+    pairs = []
+    for lo in range(0, len(books), block):
+        inter = sparse.triu(X[lo:lo + block] @ X.T, k=lo + 1).tocoo()
+        i = inter.row + lo
+        keep = inter.data / np.minimum(sizes[i], sizes[inter.col]) >= min_overlap
+        i, j = i[keep], inter.col[keep]
+        order = np.lexsort((j, i))
+        pairs.extend(zip(i[order].tolist(), j[order].tolist()))
+    return pairs
+
+
+def knn_snapshot(books, nbrs):
+    '''Books + per-row neighbour indices -> the k-NN graph, edges added in the
+    same order whichever engine produced `nbrs`.'''
+    G = nx.Graph()
+    for b in books:
+        G.add_node(b["title"], genres=b["genres"])
+    for b, row in zip(books, nbrs):
+        for j in row:
+            G.add_edge(b["title"], books[int(j)]["title"])
+    G.remove_nodes_from(list(nx.isolates(G)))
+    return G
 
 
-def build_snapshot(books_so_far):
+def build_snapshot(books_so_far, config=None):
     '''All books published up to and including the current year -> one graph.'''
-    G = nx.Graph()
-    for b in books_so_far:
-        G.add_node(b["title"], genres=b["genres"])
+    config = config or TimelineConfig()
     books = list(books_so_far)
 
-    if EDGE_METHOD == "semantic" and EDGE_KNN and len(books) > 2:
+    if config.edge_method == "semantic" and config.edge_knn and len(books) > 2:
         # k-nearest-neighbors graph from the precomputed description vectors.
-        M = np.vstack([b["vec"] for b in books])
-        sims = M @ M.T
-        np.fill_diagonal(sims, -1.0)
-        k = min(EDGE_KNN, len(books) - 1)
-        for i, b in enumerate(books):
-            for j in np.argpartition(-sims[i], k)[:k]:
-                G.add_edge(b["title"], books[int(j)]["title"])
+        M = stack([b["vec"] for b in books])
+        A = knn_adjacency(M, config.edge_knn, backend=config.knn_backend)
+        return knn_snapshot(books, A.indices.reshape(len(books), -1))
+
+    G = nx.Graph()
+    for b in books:
+        G.add_node(b["title"], genres=b["genres"])
+    if config.edge_method != "semantic" and config.edge_min_overlap > 0:
+        for i, j in genre_edges(books, config.edge_min_overlap):
+            G.add_edge(books[i]["title"], books[j]["title"])
     else:
         for i in range(len(books)):
             for j in range(i + 1, len(books)):
-                if edge_valid(books[i], books[j]):
+                if edge_valid(books[i], books[j], config):
                     G.add_edge(books[i]["title"], books[j]["title"])
 
     G.remove_nodes_from(list(nx.isolates(G)))
     return G
 
 
-def detect_communities(G):
+class IncrementalKNN:
+    '''Cumulative k-NN lists grown one publication year at a time.
+
+    Every book keeps a bounded top-k of (similarity, index) across years, in
+    knn_adjacency's order. A new year's books are compared only against the
+    books already present: their own top-k comes from that one block, and an
+    existing book's list is re-merged only if a newcomer displaces its current
+    k-th neighbour. A year then costs O(new * total) instead of rebuilding
+    the full O(total^2) similarity matrix for every snapshot.
+    '''
+
+    def __init__(self, k):
+        self.k = k
+        self.M = None                                   # (n, d) vectors so far
+        self.nbr = np.empty((0, k), dtype=np.int64)     # padded with -1
+        self.sim = np.empty((0, k), dtype=np.float64)   # padded with -inf
+
+    def __len__(self):
+        return 0 if self.M is None else self.M.shape[0]
+
+    def _merge(self, sim, idx):
+        '''Keep each row's k best candidates, ordered as knn_adjacency does.'''
+        order = np.lexsort((idx, -sim), axis=1)[:, :self.k]
+        return (np.take_along_axis(sim, order, axis=1),
+                np.take_along_axis(idx, order, axis=1))
+
+    def add(self, vecs):
+        V = stack(vecs).astype(np.float64)              # similarity() casts anyway
+        n, b = len(self), V.shape[0]
+        self.M = V if self.M is None else stack([self.M, V])
+        S = similarity(V, self.M).astype(np.float64)    # (b, n + b)
+        S[np.arange(b), n + np.arange(b)] = -np.inf     # never your own neighbour
+
+        # newcomers: top-k over everyone published so far
+        cols = np.broadcast_to(np.arange(n + b), S.shape)
+        pad = max(self.k - (n + b), 0)
+        if pad:
+            S = np.hstack([S, np.full((b, pad), -np.inf)])
+            cols = np.hstack([cols, np.full((b, pad), -1)])
+        new_sim, new_nbr = self._merge(S, cols)
+        new_nbr[np.isneginf(new_sim)] = -1
+
+        # existing books: merge only the rows whose k-th neighbour is displaced
+        if n:
+            cross = S[:, :n].T                          # (n, b)
+            hit = (cross > self.sim[:, -1:]).any(axis=1)
+            if hit.any():
+                idx = np.broadcast_to(np.arange(n, n + b), (int(hit.sum()), b))
+                self.sim[hit], self.nbr[hit] = self._merge(
+                    np.hstack([self.sim[hit], cross[hit]]),
+                    np.hstack([self.nbr[hit], idx]))
+
+        self.sim = np.vstack([self.sim, new_sim])
+        self.nbr = np.vstack([self.nbr, new_nbr])
+
+    def neighbors(self):
+        '''Top-min(k, n-1) neighbour indices per book, as knn_adjacency returns.'''
+        return self.nbr[:, :min(self.k, len(self) - 1)]
+
+
+def detect_communities(G, config=None):
     '''Return a list of frozenset-of-titles, one per community.'''
+    config = config or TimelineConfig()
     if G.number_of_nodes() == 0:
         return []
     try:
-        comms = nx_comm.louvain_communities(G, seed=42)
+        comms = nx_comm.louvain_communities(G, seed=config.seed)
     except Exception:
         comms = nx_comm.greedy_modularity_communities(G)
     return [frozenset(c) for c in comms if len(c) >= 3]   # ignore tiny specks
 
 
-# --- 4 + 5. match communities across years, classify mutations --------------
-def jaccard(a, b):
-    if not a or not b:
-        return 0.0
-    return len(a & b) / len(a | b)
+def warm_louvain(G, prev_G, prev_partition, seed=42):
+    '''Louvain on snapshot G, started from the previous snapshot's partition.
+
+    Year t's graph is year t-1's plus a handful of books, so most of a cold
+    run re-derives last year's answer. The affected region - new books, books
+    whose edges changed, and their neighbours - is released to singletons;
+    what is left of each of last year's communities enters as one weighted
+    supernode. A new book therefore starts next to the community it has most
+    edges into, Louvain re-optimises only the released region, and untouched
+    genres can still absorb it or merge. Returns the full partition.
+    '''
+    com_of = {}
+    for ci, c in enumerate(prev_partition):
+        for u in c:
+            if u in G:
+                com_of[u] = ci
+
+    changed = [u for u in G if u not in com_of or u not in prev_G
+               or set(G[u]) != set(prev_G[u])]
+    released = set(changed)
+    for u in changed:
+        released.update(G[u])
+
+    unit = {}                       # node -> supernode id in the aggregate
+    groups = []
+    for c in prev_partition:
+        members = [u for u in c if u in G and u not in released]
+        if members:
+            for u in members:
+                unit[u] = len(groups)
+            groups.append(set(members))
+    for u in G:
+        if u not in unit:
+            unit[u] = len(groups)
+            groups.append({u})
+
+    H = nx.Graph()
+    H.add_nodes_from(range(len(groups)))
+    for u, v in G.edges():
+        cu, cv = unit[u], unit[v]
+        w = H[cu][cv]["weight"] + 1 if H.has_edge(cu, cv) else 1
+        H.add_edge(cu, cv, weight=w)
+    merged = nx_comm.louvain_communities(H, weight="weight", seed=seed)
+    return [set().union(*(groups[i] for i in m)) for m in merged]
+
+
+class WarmCommunities:
+    '''detect_communities for a run of cumulative snapshots, remembering the
+    previous graph and its full (unfiltered) partition between calls.'''
+
+    def __init__(self, seed=42):
+        self.seed = seed
+        self.G = None
+        self.partition = []
+
+    def __call__(self, G):
+        if G.number_of_nodes() == 0:
+            return []
+        if self.G is None or not self.partition:
+            partition = nx_comm.louvain_communities(G, seed=self.seed)
+        else:
+            partition = warm_louvain(G, self.G, self.partition, seed=self.seed)
+        self.G, self.partition = G, partition
+        return [frozenset(c) for c in partition if len(c) >= 3]
 
 
-def classify_mutations(prev, curr):
+# --- 4 + 5. match communities across years, classify mutations --------------
+def incidence(comms, index):
+    '''Communities -> sparse node x community 0/1 matrix, rows per `index`.'''
+    rows = [index[t] for c in comms for t in c]
+    cols = [ci for ci, c in enumerate(comms) for _ in c]
+    return sparse.csc_matrix((np.ones(len(rows)), (rows, cols)),
+                             shape=(len(index), len(comms)))
+
+
+def match_communities(prev, curr, min_jaccard):
+    '''ancestors[i] = prev-indices whose Jaccard with curr[i] clears
+    min_jaccard. Intersections for every pair come from one sparse
+    product of the two incidence matrices and unions from their column sums,
+    so only pairs that share a member are ever looked at.'''
+    if min_jaccard <= 0:                # then even disjoint pairs match
+        return [list(range(len(prev))) for _ in curr]
+    ancestors = [[] for _ in curr]
+    if not prev or not curr:
+        return ancestors
+
+    index = {t: i for i, t in enumerate(set().union(*prev, *curr))}
+    P, C = incidence(prev, index), incidence(curr, index)
+    inter = (P.T @ C).tocoo()                       # (prev, curr) overlaps
+    size_p = np.asarray(P.sum(axis=0)).ravel()
+    size_c = np.asarray(C.sum(axis=0)).ravel()
+    jac = inter.data / (size_p[inter.row] + size_c[inter.col] - inter.data)
+
+    hit = jac >= min_jaccard
+    for pi, ci in sorted(zip(inter.row[hit].tolist(), inter.col[hit].tolist())):
+        ancestors[ci].append(pi)
+    return ancestors
+
+
+def classify_mutations(prev, curr, config=None):
     '''
     prev, curr: lists of community sets (year t-1 and year t).
     Returns counts of births / splits / merges between the two snapshots.
     '''
-    births, splits, merges = 0, 0, 0
-
+    config = config or TimelineConfig()
     # For each current community, who in prev does it descend from?
-    ancestors = []          # ancestors[i] = list of prev-indices matching curr[i]
-    for c in curr:
-        anc = [i for i, p in enumerate(prev) if jaccard(p, c) >= MATCH_MIN_JACCARD]
-        ancestors.append(anc)
-        if not anc:
-            births += 1     # no lineage in t-1 -> a new genre appeared
+    ancestors = match_communities(prev, curr, config.match_min_jaccard)
+    births = sum(1 for anc in ancestors if not anc)   # no lineage in t-1
 
     # A prev community that maps forward to >1 current communities = a split.
-    forward = defaultdict(list)
-    for ci, anc in enumerate(ancestors):
-        for pi in anc:
-            forward[pi].append(ci)
-    splits = sum(1 for pi, children in forward.items() if len(children) > 1)
+    forward = np.zeros(len(prev), dtype=np.int64)
+    for anc in ancestors:
+        forward[anc] += 1
+    splits = int((forward > 1).sum())
 
     # A current community with >1 ancestors = a merge.
     merges = sum(1 for anc in ancestors if len(anc) > 1)
@@ -174,17 +402,35 @@ def classify_mutations(prev, curr):
 
 
 # --- driver -----------------------------------------------------------------
-def mutation_timeline(grouped):
+def mutation_timeline(grouped, config=None):
+    config = config or TimelineConfig()
     years = sorted(grouped)
     cumulative = []
     prev_comms = []
     timeline = []
 
+    # Exact semantic k-NN snapshots are grown incrementally rather than rebuilt
+    # from scratch each year; the graphs are identical either way. The LSH
+    # backend rebuilds each snapshot, which is already linear in its size.
+    knn = None
+    if (config.edge_method == "semantic" and config.edge_knn
+            and config.knn_backend != "lsh"):
+        knn = IncrementalKNN(config.edge_knn)
+    if config.community_mode == "warm":
+        detect = WarmCommunities(config.seed)
+    else:
+        detect = functools.partial(detect_communities, config=config)
+
     for year in years:
         cumulative.extend(grouped[year])
-        G = build_snapshot(cumulative)
-        comms = detect_communities(G)
-        events = classify_mutations(prev_comms, comms)
+        if knn is not None:
+            knn.add([b["vec"] for b in grouped[year]])
+        if knn is not None and len(cumulative) > 2:
+            G = knn_snapshot(cumulative, knn.neighbors())
+        else:
+            G = build_snapshot(cumulative, config)
+        comms = detect(G)
+        events = classify_mutations(prev_comms, comms, config)
         events["year"] = year
         events["mutations"] = events["births"] + events["splits"] + events["merges"]
         timeline.append(events)
@@ -193,6 +439,81 @@ def mutation_timeline(grouped):
     return timeline
 
 
+# --- k / seed robustness sweep ------------------------------------------------
+def knn_history(grouped, k):
+    '''Grow the exact semantic k-NN lists once, at the largest k of a sweep
+    (timeline_sweep only replays them for exact semantic configs). Returns
+    the cumulative books and, per year, (year, n, changed rows, their padded
+    neighbour rows): just the rows that year added or rewired. Rows are in
+    descending-similarity order, so any smaller k is a prefix of each row.'''
+    knn = IncrementalKNN(k)
+    books, history = [], []
+    prev = np.empty((0, k), dtype=np.int64)
+    for year in sorted(grouped):
+        books.extend(grouped[year])
+        knn.add([b["vec"] for b in grouped[year]])
+        old = len(prev)
+        changed = np.flatnonzero((knn.nbr[:old] != prev).any(axis=1))
+        rows = np.concatenate([changed, np.arange(old, len(books))])
+        history.append((year, len(books), rows, knn.nbr[rows].copy()))
+        prev = knn.nbr.copy()
+    return books, history
+
+
+def _sweep_timeline(task):
+    '''One (k, seed) timeline replayed from a shared knn_history.'''
+    books, history, config = task
+    k = config.edge_knn
+    if config.community_mode == "warm":
+        detect = WarmCommunities(config.seed)
+    else:
+        detect = functools.partial(detect_communities, config=config)
+    nbr = np.empty((0, history[-1][3].shape[1]), dtype=np.int64)
+    prev_comms, timeline = [], []
+    for year, n, rows, vals in history:
+        nbr = np.vstack([nbr, np.empty((n - len(nbr), nbr.shape[1]), dtype=np.int64)])
+        nbr[rows] = vals
+        comms = []
+        if n > 2:     # fewer books can't hold a 3-member community anyway
+            comms = detect(knn_snapshot(books[:n], nbr[:, :min(k, n - 1)]))
+        events = classify_mutations(prev_comms, comms, config)
+        events["year"] = year
+        events["mutations"] = events["births"] + events["splits"] + events["merges"]
+        timeline.append(events)
+        prev_comms = comms
+    return timeline
+
+
+def _full_timeline(task):
+    '''One (k, seed) timeline built from scratch by mutation_timeline.'''
+    grouped, config = task
+    return mutation_timeline(grouped, config)
+
+
+def timeline_sweep(grouped, ks, seeds=(42,), config=None, workers=None):
+    '''Mutation timelines for every (k, seed) pair -> {(k, seed): tl}, all
+    other settings taken from `config`.
+
+    For exact semantic k-NN edges the k-NN lists are computed once at max(ks)
+    and every smaller k is read off by truncation; the (k, seed) grid then
+    runs across a process pool, each worker replaying only the per-year
+    neighbour changes. Any other edge method or k-NN backend has no shared
+    history to replay, so each (k, seed) runs mutation_timeline in full -
+    still across the pool, and still honouring every config field.'''
+    config = config or TimelineConfig()
+    grid = [(k, seed) for k in ks for seed in seeds]
+    configs = [replace(config, edge_knn=k, seed=seed) for k, seed in grid]
+    if config.edge_method != "semantic" or config.knn_backend == "lsh":
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(grid, pool.map(_full_timeline,
+                                           [(grouped, c) for c in configs])))
+    books, history = knn_history(grouped, max(ks))
+    light = [{"title": b["title"], "genres": b["genres"]} for b in books]
+    tasks = [(light, history, c) for c in configs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(grid, pool.map(_sweep_timeline, tasks)))
+
+
 def synthetic_corpus():
     '''Tiny fake corpus so the pipeline runs with nothing scraped.
     Designed so a new "cyberpunk" cluster splits out of sci-fi over time.'''
@@ -222,8 +543,9 @@ def main():
         books = synthetic_corpus()
         source = "SYNTHETIC fallback (no _data/books.json found)"
 
-    grouped = books_by_year(books)
-    timeline = mutation_timeline(grouped)
+    config = TimelineConfig()
+    grouped = books_by_year(books, config)
+    timeline = mutation_timeline(grouped, config)
 
     print(f"Source: {source}")
     print(f"{len(books)} books -> {len(grouped)} publication years\n")
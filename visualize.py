@@ -22,9 +22,10 @@ import numpy as np
 import networkx as nx
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 from constants import shelved_books
+from controls import concentration_z
+from semantic_edges import knn_adjacency, knn_edges, tfidf_features
 
 OUT = "literary_genres.html"
 PALETTE = ["#e6194B", "#3cb44b", "#4363d8", "#f58231", "#911eb4", "#42d4f4",
@@ -38,10 +39,7 @@ def main():
     authors = [b["author"] for b in books]
     years = np.array([int(b["date_published"]) for b in books], float)
 
-    V = TfidfVectorizer(stop_words="english", max_features=20000,
-                        min_df=3, max_df=0.4, sublinear_tf=True)
-    X = V.fit_transform([b["description"] for b in books]).toarray().astype(np.float32)
-    terms = np.array(V.get_feature_names_out())
+    X, terms = tfidf_features([b["description"] for b in books])     # CSR
 
     # one book per author (earliest) + style-drift de-trend
     seen, keep = set(), []
@@ -51,23 +49,18 @@ def main():
     keep = np.array(sorted(keep))
     Xk, yk = X[keep], years[keep]
     yc = yk - yk.mean()
-    Xkd = Xk - np.outer(yc, (Xk * yc[:, None]).sum(0) / (yc @ yc))
+    Xkd = Xk.toarray() - np.outer(yc, (Xk.T @ yc) / (yc @ yc))
     M = Xkd / np.clip(np.linalg.norm(Xkd, axis=1, keepdims=True), 1e-9, None)
 
-    S = M @ M.T
-    np.fill_diagonal(S, -1.0)
     G = nx.Graph()
     G.add_nodes_from(range(len(keep)))
-    for i in range(len(keep)):
-        for j in np.argpartition(-S[i], K)[:K]:
-            G.add_edge(i, int(j))
+    G.add_edges_from(knn_edges(knn_adjacency(M, K)))
     import networkx.algorithms.community as nxc
     comms = [c for c in nxc.louvain_communities(G, seed=42) if len(c) >= 5]
 
     rng = np.random.default_rng(0)
     def zconc(idx):
-        d = [yk[rng.choice(len(yk), len(idx), replace=False)].std() for _ in range(2000)]
-        return (yk[idx].std() - np.mean(d)) / np.std(d)
+        return concentration_z(yk[idx], yk, rng, trials=2000)
 
     import collections
     NOISE = ("Best Books", "Category", "--", "Listings", "Banned Books",
@@ -24,6 +24,7 @@
 import json
 import os
 
+from build_influence_graph import load_influence_graph
 from constants import shelved_books
 
 OUT = "influence_network.html"
@@ -48,8 +49,7 @@ def build_validated_index(known, wikidata):
 
 
 def main():
-    graph = json.load(open(os.path.join(shelved_books, "influence_graph.json"),
-                       encoding="utf-8"))
+    graph, columns = load_influence_graph()
     known = json.load(open(os.path.join(shelved_books, "known_influences.json"),
                        encoding="utf-8"))
     wikidata = json.load(open(os.path.join(shelved_books, "wikidata_influences.json"),
@@ -70,8 +70,12 @@ def main():
 
     edges = []
     n_validated_in_graph = 0
-    for e in graph["edges"]:
-        key = (e["from"], e["to"])
+    names = [a["name"] for a in graph["authors"]]
+    for i, j, styl, conc, same_form, gap in zip(
+            columns["from"].tolist(), columns["to"].tolist(),
+            columns["stylistic"].tolist(), columns["conceptual"].tolist(),
+            columns["same_form"].tolist(), columns["year_gap"].tolist()):
+        key = (names[i], names[j])
         v = validated_idx.get(key)
         validated = None
         note = None
@@ -86,12 +90,12 @@ def main():
             if isinstance(v.get("known"), str):
                 note = v["known"]
         edges.append({
-            "from": id_of[e["from"]],
-            "to": id_of[e["to"]],
-            "stylistic": e["stylistic"],
-            "conceptual": e["conceptual"],
-            "sameForm": e["same_form"],
-            "yearGap": e["year_gap"],
+            "from": id_of[names[i]],
+            "to": id_of[names[j]],
+            "stylistic": round(styl, 4),
+            "conceptual": round(conc, 4),
+            "sameForm": same_form,
+            "yearGap": gap,
             "validated": validated,
             "note": note,
         })